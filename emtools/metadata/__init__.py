@@ -18,9 +18,12 @@ from .table import Column, ColumnList, Table
 from .starfile import StarFile, StarMonitor
 from .epu import EPU
 from .misc import Bins, TsBins, DataFiles, MovieFiles, Mdoc, TextFile
-from .sqlite import SqliteFile
+from .sqlite import SqliteFile, SqliteMonitor, SqliteCollection
+from .seen import SeenKeys, HashedSeenKeys, SeenRowCount
+from .monitors import MonitorGroup
 
 
 __all__ = ["Column", "ColumnList", "Table", "StarFile", "StarMonitor", "EPU",
-           "Bins", "TsBins", "SqliteFile", "DataFiles", "MovieFiles",
-           "Mdoc", "TextFile"]
+           "Bins", "TsBins", "SqliteFile", "SqliteMonitor",
+           "SqliteCollection", "DataFiles", "MovieFiles", "Mdoc", "TextFile",
+           "SeenKeys", "HashedSeenKeys", "SeenRowCount", "MonitorGroup"]
@@ -15,10 +15,15 @@
 # **************************************************************************
 
 import os
+import json
+import sqlite3
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
 from datetime import datetime, timedelta
-import xmltodict
+from xml.parsers import expat
 
-from emtools.utils import Pretty, Path, Color, Process
+from emtools.utils import Pretty, Path, Color, Process, FileWatcher
 from .table import Table
 from .starfile import StarFile
 from .misc import MovieFiles
@@ -26,70 +31,210 @@ from .misc import MovieFiles
 
 class EPU:
     MOVIES_SUFFICES = ['_fractions.tiff', '_EER.eer']
+    # Paths (tags without namespace from the root element) of values
+    # in EPU's xml movie files that can be parsed with EPU.parse_xml
+    XML_FIELDS = {
+        'beamShiftX': ('microscopeData', 'optics', 'BeamShift', '_x'),
+        'beamShiftY': ('microscopeData', 'optics', 'BeamShift', '_y'),
+        'pixelSizeX': ('SpatialScale', 'pixelSize', 'x', 'numericValue'),
+        'pixelSizeY': ('SpatialScale', 'pixelSize', 'y', 'numericValue'),
+        'defocus': ('microscopeData', 'optics', 'Defocus'),
+        'appliedDefocus': ('CustomData', 'AppliedDefocus'),
+        'stageX': ('microscopeData', 'stage', 'Position', 'X'),
+        'stageY': ('microscopeData', 'stage', 'Position', 'Y'),
+        'stageZ': ('microscopeData', 'stage', 'Position', 'Z'),
+        'dose': ('CustomData', 'Dose'),
+        'acquisitionDateTime': ('microscopeData', 'acquisition',
+                                'acquisitionDateTime')
+    }
+
+    # Paths of the values used by EPU.get_acquisition
+    _ACQUISITION_FIELDS = {
+        'pixelSizeX': XML_FIELDS['pixelSizeX'],
+        'pixelSizeY': XML_FIELDS['pixelSizeY'],
+        'voltage': ('microscopeData', 'gun', 'AccelerationVoltage'),
+        'instrumentId': ('microscopeData', 'instrument', 'InstrumentID'),
+        'instrumentModel': ('microscopeData', 'instrument', 'InstrumentModel'),
+        'magnification': ('microscopeData', 'optics', 'TemMagnification',
+                          'NominalMagnification'),
+        'binningX': ('microscopeData', 'acquisition', 'camera', 'Binning', 'x'),
+        'binningY': ('microscopeData', 'acquisition', 'camera', 'Binning', 'y'),
+        'darkGainCorrection': ('microscopeData', 'acquisition', 'camera',
+                               'DarkGainCorrection'),
+        'exposureTime': ('microscopeData', 'acquisition', 'camera',
+                         'ExposureTime'),
+        'readoutHeight': ('microscopeData', 'acquisition', 'camera',
+                          'ReadoutArea', 'height'),
+        'readoutWidth': ('microscopeData', 'acquisition', 'camera',
+                         'ReadoutArea', 'width')
+    }
+
     @staticmethod
-    def get_acquisition(movieXmlFn):
-        """ Parse acquisition parameters from EPU's xml movie file. """
-        with open(movieXmlFn) as f:
-            xmljson = xmltodict.parse(f.read())
+    def get_acquisition(movieXmlFn, cache=None):
+        """ Parse acquisition parameters from EPU's xml movie file.
+        Only the needed values are parsed (as in EPU.parse_xml).
+        If cache (EPU.Cache) is given, the file is only parsed if
+        it is not there.
+        """
+        if cache is not None:
+            return cache.get_acquisition(movieXmlFn)
+
+        values = _parseXmlPaths(movieXmlFn, {
+            path: name for name, path in EPU._ACQUISITION_FIELDS.items()})
 
-        pixelSize = xmljson['MicroscopeImage']['SpatialScale'].get('pixelSize', None)
-        data = xmljson['MicroscopeImage']['microscopeData']
-        instrument = data['instrument']
-        camera = data['acquisition']['camera']
+        def _value(k):
+            return values.get(k) or None  # Empty elements as None
 
         def _pixelSize(k):
-            if not pixelSize:
+            if not values.get(k):
                 return ''
-            ps = float(pixelSize[k]['numericValue']) * (10**10)
+            ps = float(values[k]) * (10**10)
             return f'{ps:0.5f}'
 
-        data = {
-            'pixelSize': {'x': _pixelSize('x'), 'y': _pixelSize('y')},
-            'voltage': data['gun']['AccelerationVoltage'],
-            'instrument': {'id': instrument['InstrumentID'],
-                           'model': instrument['InstrumentModel']},
-            'magnification': data['optics']['TemMagnification']['NominalMagnification'],
+        return {
+            'pixelSize': {'x': _pixelSize('pixelSizeX'),
+                          'y': _pixelSize('pixelSizeY')},
+            'voltage': _value('voltage'),
+            'instrument': {'id': _value('instrumentId'),
+                           'model': _value('instrumentModel')},
+            'magnification': _value('magnification'),
             'camera': {
-                'Binning': {'x': camera['Binning']['a:x'],
-                            'y': camera['Binning']['a:y']},
-                'DarkGainCorrection': camera['DarkGainCorrection'],
-                'ExposureTime': camera['ExposureTime'],
-                'ReadoutArea': {'height': camera['ReadoutArea']['a:height'],
-                                'width': camera['ReadoutArea']['a:width']}
-           }
+                'Binning': {'x': _value('binningX'),
+                            'y': _value('binningY')},
+                'DarkGainCorrection': _value('darkGainCorrection'),
+                'ExposureTime': _value('exposureTime'),
+                'ReadoutArea': {'height': _value('readoutHeight'),
+                                'width': _value('readoutWidth')}
+            }
         }
 
-        return data
+    @staticmethod
+    def parse_xml(xmlFile, fields=None):
+        """ Parse only some values from EPU's xml movie file.
+
+        The file is read with a streaming (expat) parser, without building
+        the whole tree, and the parsing stops as soon as all fields
+        are found.
+
+        Args:
+            xmlFile: input xml file.
+            fields: list of names from EPU.XML_FIELDS or dict with
+                {name: path}, where path is a tuple with the tags (without
+                namespace) from the root element. Values in CustomData
+                are found by their key, e.g. ('CustomData', 'Dose').
+                By default, all EPU.XML_FIELDS are parsed.
+        Return:
+            dict with the text of each field, None for missing ones.
+        """
+        fields = _getXmlFields(fields)
+        values = dict.fromkeys(fields)
+        values.update(_parseXmlPaths(xmlFile, {path: name for name, path
+                                               in fields.items()}))
+        return values
 
     @staticmethod
     def parse_beam_shifts(xmlFile):
         """ Parse x and y shifts from the provided xml file. """
-        with open(xmlFile) as f:
-            d = xmltodict.parse(f.read())
-            bt = d['MicroscopeImage']['microscopeData']['optics']['BeamShift']
-            x, y = bt['a:_x'], bt['a:_y']
-            return x, y
+        values = EPU.parse_xml(xmlFile, ['beamShiftX', 'beamShiftY'])
+        return values['beamShiftX'], values['beamShiftY']
 
     @staticmethod
-    def get_beam_shifts(xmlDir):
+    def get_beam_shifts(xmlDir, cache=None):
         """ Parse beam tilts from EPU's xml movie files.
         Args:
             xmlDir: Parse beam shifts from all movies' xml in this dir
+            cache: optional EPU.Cache to store/retrieve the values.
         Return:
             Iterator over the parsed files. Each iteration will yield:
                 MovieBaseName, xshift, yshift
         """
+        for fn, values in EPU.harvest(xmlDir, ['beamShiftX', 'beamShiftY'],
+                                      workers=1, cache=cache):
+            yield fn, values['beamShiftX'], values['beamShiftY']
+
+    @staticmethod
+    def harvest(xmlDir, fields=None, workers=4, chunkSize=256, cache=None):
+        """ Parse values from EPU's xml files of all movies in a folder.
+
+        Xml files are parsed (see EPU.parse_xml) in chunks by a pool of
+        processes, while the folder is still being walked. Results are
+        returned in the same order the movies are found.
+
+        Args:
+            xmlDir: Parse values from all movies' xml in this dir.
+            fields: names or paths of the values to parse, by default
+                all EPU.XML_FIELDS.
+            workers: number of processes, if 1, parse in this process.
+            chunkSize: number of xml files parsed in each task.
+            cache: optional EPU.Cache, only files not found there are
+                parsed and their values are added to it.
+        Return:
+            Iterator over the parsed files. Each iteration will yield:
+                MovieBaseName, dict with the parsed values
+        """
+        fields = _getXmlFields(fields)
+        if not _isCacheable(fields):
+            cache = None
+        # All values are parsed to be stored in the cache
+        parseFields = EPU.XML_FIELDS if cache is not None else fields
         missing_xml = []
-        for root, dirs, files in os.walk(xmlDir):
-            for fn in files:
-                # Check existing movies first
-                if xmlFn := EPU.get_movie_xml(fn):
-                    xmlPath = os.path.join(root, xmlFn)
-                    if os.path.exists(xmlPath):
-                        x, y = EPU.parse_beam_shifts(xmlPath)
-                        yield fn, x, y
-                    else:
-                        missing_xml.append(xmlPath)
+
+        def _chunks():
+            chunk = []
+            for root, dirs, files in os.walk(xmlDir):
+                for fn in files:
+                    # Check existing movies first
+                    if xmlFn := EPU.get_movie_xml(fn):
+                        xmlPath = os.path.join(root, xmlFn)
+                        if os.path.exists(xmlPath):
+                            chunk.append((fn, xmlPath))
+                            if len(chunk) == chunkSize:
+                                yield chunk
+                                chunk = []
+                        else:
+                            missing_xml.append(xmlPath)
+            if chunk:
+                yield chunk
+
+        def _submit(executor, chunk):
+            """ Lookup the chunk's files in the cache and parse the
+            missing ones, in the pool if there is an executor. """
+            xmlFiles = [xmlPath for _, xmlPath in chunk]
+            if cache is not None:
+                stats, values = cache.lookup(xmlFiles)
+            else:
+                stats, values = None, [None] * len(xmlFiles)
+            missing = [f for f, v in zip(xmlFiles, values) if v is None]
+            if executor and missing:
+                parsed = executor.submit(_parseXmlFiles, missing, parseFields)
+            else:
+                parsed = _parseXmlFiles(missing, parseFields)
+            return chunk, stats, values, parsed
+
+        def _results(chunk, stats, values, parsed):
+            if not isinstance(parsed, list):
+                parsed = parsed.result()
+            missing = [i for i, v in enumerate(values) if v is None]
+            for i, v in zip(missing, parsed):
+                values[i] = v
+            if cache is not None and missing:
+                cache.store([chunk[i][1] for i in missing],
+                            [stats[i] for i in missing], parsed)
+            for (fn, _), v in zip(chunk, values):
+                yield fn, {k: v[k] for k in fields}
+
+        executor = None
+        if workers > 1:
+            executor = ProcessPoolExecutor(max_workers=workers)
+        with executor or nullcontext():
+            # Keep a few chunks ahead to have all processes busy
+            pending = deque()
+            for chunk in _chunks():
+                pending.append(_submit(executor, chunk))
+                if len(pending) > 2 * max(workers, 1):
+                    yield from _results(*pending.popleft())
+            while pending:
+                yield from _results(*pending.popleft())
 
         if missing_xml:
             print('Missing XML files for the following movies:')
@@ -133,10 +278,11 @@ class EPU:
         """ Class to keep track of EPU files and associated metadata.
         The information can be read/write from/to a STAR file.
         """
-        def __init__(self, rootFolder, epuStar):
+        def __init__(self, rootFolder, epuStar, cache=None):
             self._acq = None
             self._rootFolder = rootFolder
             self._epuStar = epuStar
+            self._cache = cache  # Optional EPU.Cache for xml values
 
             # If the file already exist, read from disk
             if os.path.exists(self._epuStar):
@@ -148,12 +294,23 @@ class EPU:
                 self.moviesTable = Table(['movieBaseName', 'gsId', 'fhId',
                                           'timeStamp', 'beamShiftX',
                                           'beamShiftY'])
-            self.gsDict = {row.id: row for row in self.gsTable}
+            self.gsTable.createIndex('id', unique=True)
 
-        def write(self):
-            with StarFile(self._epuStar, 'w') as sf:
+        def write(self, fileName=None):
+            """ Write the tables to the star file (or to fileName). """
+            with StarFile(fileName or self._epuStar, 'w') as sf:
                 sf.writeTable('GridSquares', self.gsTable)
-                sf.writeTable('Movies', self.moviesTable)
+                # Movies is the last table and no blank line is written
+                # after the rows, so new movies can be appended
+                sf.writeHeader('Movies', self.moviesTable)
+                sf.writeRows(self.moviesTable)
+
+        def appendMovies(self, first, fileName=None):
+            """ Append movies from index 'first' to a star file written
+            by write(). No new grid squares should have been added.
+            """
+            with StarFile(fileName or self._epuStar, 'a') as sf:
+                sf.writeRows(self.moviesTable[first:])
 
         def addMovie(self, movieFn, movieStat):
             """ Add this movie and try to parse its corresponding XML file.
@@ -161,10 +318,33 @@ class EPU:
             NOTE 2: movies should be added in ascending order regarding
                 modification time.
             """
+            self.addMovies([(movieFn, movieStat)])
+
+        def addMovies(self, movies):
+            """ Add many movies (list of (movieFn, movieStat) pairs,
+            see addMovie), parsing all their XML files at once.
+            """
+            xmlFiles = []
+            for movieFn, _ in movies:
+                folder, fn = os.path.split(movieFn)
+                xmlFn = EPU.get_movie_xml(fn)
+                xmlPath = os.path.join(self._rootFolder, folder, xmlFn)
+                xmlFiles.append(xmlPath if xmlFn and os.path.exists(xmlPath)
+                                else None)
+
+            found = [f for f in xmlFiles if f]
+            shifts = _parseXmlFiles(found, ['beamShiftX', 'beamShiftY'],
+                                    cache=self._cache)
+            shifts = dict(zip(found, shifts))
+
+            for (movieFn, movieStat), xmlPath in zip(movies, xmlFiles):
+                self._addMovie(movieFn, movieStat, xmlPath, shifts.get(xmlPath))
+
+        def _addMovie(self, movieFn, movieStat, xmlPath, shifts):
             loc = EPU.get_movie_location(movieFn)
             gridSquare = loc['gs']
 
-            if gridSquare not in self.gsDict:
+            if not self.gsTable.contains('id', gridSquare):
                 gsFolder = os.path.join('Images-Disc1', gridSquare)
                 values = {'id': gridSquare,
                           'folder': gsFolder,
@@ -180,7 +360,7 @@ class EPU:
                                 values['xml'] = fn
                 else:
                     print(f"Missing folder: {gsPath}")
-                self.gsDict[gridSquare] = self.gsTable.addRowValues(**values)
+                self.gsTable.addRowValues(**values)
 
             mtime = movieStat.st_mtime
 
@@ -191,13 +371,11 @@ class EPU:
                 'beamShiftY': -9999.0,
                 'timeStamp': mtime
             }
-            xmlFn = EPU.get_movie_xml(movieFn)
-            if os.path.exists(xmlFn):
-                x, y = EPU.parse_beam_shifts(xmlFn)
+            if xmlPath:
                 if self._acq is None:
-                    self._acq = EPU.get_acquisition(xmlFn)
-                values['beamShiftX'] = x
-                values['beamShiftY'] = y
+                    self._acq = EPU.get_acquisition(xmlPath, cache=self._cache)
+                values['beamShiftX'] = float(shifts['beamShiftX'] or -9999.0)
+                values['beamShiftY'] = float(shifts['beamShiftY'] or -9999.0)
 
             self.moviesTable.addRowValues(**values)
 
@@ -224,12 +402,130 @@ class EPU:
                 'duration': f'{hours:0.2f} hours',
             }
 
+    class Cache:
+        """
+        Values parsed from EPU's xml files, stored in a sqlite db file.
+
+        Values are stored for each file path (absolute) and they are only
+        used if the size and modification time of the file did not change.
+        Several tools (or runs of the same tool) can share the same db
+        file, so xml files are not parsed again after a restart.
+
+        Example:
+            with EPU.Cache('epu_xml.sqlite') as cache:
+                for fn, x, y in EPU.get_beam_shifts(xmlDir, cache=cache):
+                    ...
+        """
+        # Maximum number of paths in each lookup query
+        LOOKUP_SIZE = 500
+
+        def __init__(self, dbFile):
+            self._con = sqlite3.connect(dbFile, timeout=60)
+            with self._con:
+                self._con.execute("""
+                    CREATE TABLE IF NOT EXISTS xml_values(
+                        path TEXT, name TEXT, size INTEGER, mtime INTEGER,
+                        value TEXT, PRIMARY KEY (path, name))""")
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, exc_type, exc_val, exc_tb):
+            self.close()
+
+        def __len__(self):
+            return self._con.execute(
+                "SELECT COUNT(*) FROM xml_values").fetchone()[0]
+
+        def lookup(self, xmlFiles, name='fields'):
+            """ Find the values of many files at once.
+
+            Args:
+                xmlFiles: list of xml files.
+                name: 'fields' for the values of EPU.parse_xml or
+                    'acquisition' for the ones of EPU.get_acquisition.
+            Return:
+                Two lists with the (size, mtime) of each file, needed to
+                store() new values, and the values (None if they are not
+                in the cache or the file was modified).
+            """
+            paths = [os.path.abspath(f) for f in xmlFiles]
+            stats = []
+            for path in paths:
+                try:
+                    s = os.stat(path)
+                    stats.append((s.st_size, s.st_mtime_ns))
+                except FileNotFoundError:
+                    stats.append(None)
+
+            found = {}
+            for i in range(0, len(paths), self.LOOKUP_SIZE):
+                batch = paths[i:i + self.LOOKUP_SIZE]
+                query = ("SELECT path, size, mtime, value FROM xml_values "
+                         "WHERE name = ? AND path IN (%s)"
+                         % ', '.join('?' * len(batch)))
+                for path, size, mtime, value in self._con.execute(
+                        query, [name] + batch):
+                    found[path] = (size, mtime), value
+
+            values = []
+            for path, stat in zip(paths, stats):
+                key, value = found.get(path, (None, None))
+                values.append(json.loads(value)
+                              if stat and key == stat else None)
+            return stats, values
+
+        def store(self, xmlFiles, stats, values, name='fields'):
+            """ Store the values of many files at once.
+
+            Args:
+                xmlFiles: list of xml files.
+                stats: (size, mtime) of each file, as returned by lookup()
+                    before the files were parsed.
+                values: dict of values for each file.
+                name: 'fields' or 'acquisition', see lookup().
+            """
+            with self._con:
+                self._con.executemany(
+                    "INSERT OR REPLACE INTO xml_values VALUES (?, ?, ?, ?, ?)",
+                    [(os.path.abspath(f), name, *stat, json.dumps(value))
+                     for f, stat, value in zip(xmlFiles, stats, values)
+                     if stat is not None])
+
+        def parse_xml(self, xmlFiles):
+            """ Return the values of all EPU.XML_FIELDS for each file,
+            parsing (and storing) only the ones that are not cached. """
+            stats, values = self.lookup(xmlFiles)
+            missing = [i for i, v in enumerate(values) if v is None]
+            if missing:
+                parsed = [EPU.parse_xml(xmlFiles[i]) for i in missing]
+                for i, v in zip(missing, parsed):
+                    values[i] = v
+                self.store([xmlFiles[i] for i in missing],
+                           [stats[i] for i in missing], parsed)
+            return values
+
+        def get_acquisition(self, movieXmlFn):
+            """ Return the acquisition parameters (see
+            EPU.get_acquisition) using the cache. """
+            stats, values = self.lookup([movieXmlFn], name='acquisition')
+            if values[0] is None:
+                values[0] = EPU.get_acquisition(movieXmlFn)
+                self.store([movieXmlFn], stats, values, name='acquisition')
+            return values[0]
+
+        def close(self):
+            if getattr(self, '_con', None) is not None:
+                self._con.close()
+                self._con = None
+
     class Session:
         """
         Monitor EPU session files and allow to make a copy of GridSquares
         images and xml files.
         """
-        def __init__(self, inputDir, outputStar=None, backupFolder=None, pl=None):
+        def __init__(self, inputDir, outputStar=None, backupFolder=None, pl=None,
+                     cache=None):
             """
             Create a new EPU.Session instance.
 
@@ -238,11 +534,13 @@ class EPU:
                 outputStar: If not None, parse image parameters from the XML and write to this star file
                 backupFolder: If not None, copy some jpg and xml files to this location
                 pl: ProcessLogger instance, by default use just a default logger to stdout
+                cache: optional EPU.Cache to avoid parsing the same XML files again
             """
             self.inputDir = inputDir
             self.outputStar = outputStar
             self.backupFolder = backupFolder
             self.pl = pl or Process.Logger()
+            self.cache = cache
 
             if not os.path.exists(inputDir):
                 raise Exception(f"Input dir '{Color.red(inputDir)}' does not exist.")
@@ -255,6 +553,11 @@ class EPU:
 
             self.df = MovieFiles(root=inputDir)
             self.all_movies = []
+            self._watcher = None
+            self._data = None
+            # Modification time and subfolders of the folders that do not
+            # need to be listed again, if their modification time is the same
+            self._folders = {}
 
         def scan(self):
             """ Scan new files from the EPU session. """
@@ -283,15 +586,33 @@ class EPU:
                 for fn in [jpgFn, jpgFn.replace('.jpg', '.xml')]:
                     _backup(fn)
 
-            for root, dirs, files in os.walk(self.inputDir):
-                for f in files:
-                    fn = os.path.join(root, f)
+            folders = [self.inputDir]
+            while folders:
+                root = folders.pop()
+                try:
+                    mtime = os.stat(root).st_mtime
+                    if self._folders.get(root, (None,))[0] == mtime:
+                        # No files were added since the folder was listed
+                        folders.extend(self._folders[root][1])
+                        continue
+                    entries = list(os.scandir(root))
+                except FileNotFoundError:
+                    continue
+
+                subfolders = [e.path for e in entries if e.is_dir()]
+                folders.extend(subfolders)
+                pending = False  # Files too recent to be registered
+
+                for e in entries:
+                    f, fn = e.name, e.path
+                    if fn in df or e.is_dir():
+                        continue  # Only stat new files
                     try:
                         s = os.stat(fn)
                     except FileNotFoundError:
                         continue  # just ignore temporary files
                     dt = datetime.fromtimestamp(s.st_mtime)
-                    if now - dt >= td and fn not in df:
+                    if now - dt >= td:
                         df.register(fn, s)
                         if f.startswith('GridSquare_') and f.endswith('.jpg'):
                             _backup_pair(fn)
@@ -301,22 +622,133 @@ class EPU:
                                 movies.append((fn, s))
                             elif f.endswith('.xml'):
                                 _backup(fn)
+                    else:
+                        pending = True
+
+                if pending or now - datetime.fromtimestamp(mtime) < td:
+                    self._folders.pop(root, None)
+                else:
+                    self._folders[root] = (mtime, subfolders)
 
             movies.sort(key=lambda m: m[1].st_mtime)
 
             if self.outputStar and movies:
-                # Write first to a temporary file and then overwrite
-                tmpStar = self.outputStar + '-tmp.star'
-                print(f"Writing star {tmpStar} -> {self.outputStar}, "
-                      f"movies: {len(movies)}, total: {len(self.all_movies)}")
-                self.pl.rm(tmpStar)
-                data = EPU.Data(self.inputDir, tmpStar)
+                if self._data is None:
+                    tmpStar = self.outputStar + '-tmp.star'
+                    self.pl.rm(tmpStar)
+                    self._data = EPU.Data(self.inputDir, tmpStar,
+                                          cache=self.cache)
+
+                # Only new movies are added (and their xml parsed)
+                data = self._data
+                first, nGs = len(data.moviesTable), len(data.gsTable)
                 self.all_movies.extend(movies)
-                for i, m in enumerate(self.all_movies):
-                    movieFn, movieStat = m
-                    data.addMovie(_rel(movieFn), movieStat)
-                data.write()
-                self.pl.mv(tmpStar, self.outputStar)
+                data.addMovies([(_rel(fn), s) for fn, s in movies])
+
+                if first and len(data.gsTable) == nGs:
+                    print(f"Appending to star {self.outputStar}, "
+                          f"movies: {len(movies)}, "
+                          f"total: {len(self.all_movies)}")
+                    data.appendMovies(first, self.outputStar)
+                else:
+                    # Write first to a temporary file and then overwrite
+                    tmpStar = self.outputStar + '-tmp.star'
+                    print(f"Writing star {tmpStar} -> {self.outputStar}, "
+                          f"movies: {len(movies)}, "
+                          f"total: {len(self.all_movies)}")
+                    data.write(tmpStar)
+                    self.pl.mv(tmpStar, self.outputStar)
+
+        def wait(self, timeout=None):
+            """ Block until there are changes in the session folder
+            (or timeout seconds). Return True if there were changes.
+            """
+            if self._watcher is None:
+                self._watcher = FileWatcher(self.inputDir, recursive=True)
+            return bool(self._watcher.wait(timeout=timeout))
 
         def info(self):
             return self.df.info()
+
+
+def _getXmlFields(fields):
+    """ Return a dict {name: path} from the fields argument of
+    EPU.parse_xml. """
+    if fields is None:
+        return dict(EPU.XML_FIELDS)
+    if isinstance(fields, dict):
+        return fields
+    return {k: EPU.XML_FIELDS[k] for k in fields}
+
+
+def _isCacheable(fields):
+    """ Return True if all fields are stored in EPU.Cache. """
+    return all(EPU.XML_FIELDS.get(k) == p for k, p in fields.items())
+
+
+def _parseXmlFiles(xmlFiles, fields, cache=None):
+    """ Parse the fields from a list of xml files, used by the
+    processes of EPU.harvest. """
+    fields = _getXmlFields(fields)
+    if cache is not None and _isCacheable(fields):
+        return [{k: v[k] for k in fields} for v in cache.parse_xml(xmlFiles)]
+    return [EPU.parse_xml(xmlFile, fields) for xmlFile in xmlFiles]
+
+
+class _ParseDone(Exception):
+    """ Raised to stop the parsing when all values are found. """
+
+
+def _parseXmlPaths(xmlFile, paths):
+    """ Parse the text of the elements in the given paths.
+
+    Args:
+        xmlFile: input xml file.
+        paths: dict {path: name}, see EPU.parse_xml.
+    Return:
+        dict {name: text} for the paths found.
+    """
+    paths = dict(paths)
+    values = {}
+    stack = []
+    text = []
+    keyed = []  # Positions in the stack of key-value elements
+
+    def _start(tag, attrs):
+        stack.append(tag.rpartition('}')[2])
+        text.clear()
+
+    def _end(tag):
+        n = len(stack)
+        if stack[-1] == 'Key' and n > 1 and stack[-2].startswith('KeyValueOf'):
+            # Use the key instead of the tag to find the value
+            stack[-2] = ''.join(text).strip()
+            keyed.append(n - 2)
+            path = None
+        elif stack[-1] == 'Value' and keyed and keyed[-1] == n - 2:
+            path = tuple(stack[1:-1])
+        else:
+            path = tuple(stack[1:])
+
+        if path in paths:
+            values[paths.pop(path)] = ''.join(text).strip()
+            if not paths:
+                raise _ParseDone()
+
+        if keyed and keyed[-1] == n - 1:
+            keyed.pop()
+        stack.pop()
+        text.clear()
+
+    parser = expat.ParserCreate(namespace_separator='}')
+    parser.StartElementHandler = _start
+    parser.EndElementHandler = _end
+    parser.CharacterDataHandler = text.append
+
+    with open(xmlFile, 'rb') as f:
+        try:
+            parser.ParseFile(f)
+        except _ParseDone:
+            pass
+
+    return values
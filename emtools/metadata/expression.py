@@ -0,0 +1,248 @@
+# **************************************************************************
+# *
+# * Authors:  J. M. de la Rosa Trevin (delarosatrevin@gmail.com)
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 3 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# **************************************************************************
+
+import ast
+import operator
+
+import numpy as np
+
+
+# Value of nodes that depend on columns, when validating the expression
+_NOT_CONSTANT = object()
+
+
+def _isInt(value):
+    return isinstance(value, (int, np.integer)) and not isinstance(value, bool)
+
+
+def _nodeName(node):
+    """ Return the name of a node for error messages. """
+    if isinstance(node, ast.Name):
+        return node.id
+    if isinstance(node, ast.Attribute):
+        return node.attr
+    return ast.dump(node)
+
+
+class Expression:
+    """
+    Small and safe expression language to compute values from columns.
+
+    Expressions are parsed with Python syntax, but only a small subset
+    of it is allowed: numbers, strings, column names, arithmetic
+    operators, comparisons, boolean operators and a few functions.
+    Evaluation is done column-wise with numpy, so the values of each
+    column are retrieved as arrays.
+
+    Examples:
+        Expression('abs(rlnDefocusU - rlnDefocusV)')
+        Expression('rlnDefocusU / 10000')
+        Expression('where(rlnCtfMaxResolution < 4, 1, 0)')
+    """
+    FUNCTIONS = {
+        'abs': np.abs,
+        'sqrt': np.sqrt,
+        'min': np.minimum,
+        'max': np.maximum,
+        'where': np.where,
+        'round': np.round,
+        'floor': np.floor,
+        'ceil': np.ceil,
+    }
+
+    CONSTANTS = {
+        'pi': np.pi
+    }
+
+    # Maximum size of results of operations with constant values
+    MAX_INT_BITS = 4096
+    MAX_STR_LENGTH = 10000
+
+    _BINOPS = {
+        ast.Add: operator.add,
+        ast.Sub: operator.sub,
+        ast.Mult: operator.mul,
+        ast.Div: operator.truediv,
+        ast.FloorDiv: operator.floordiv,
+        ast.Mod: operator.mod,
+        ast.Pow: operator.pow,
+        ast.BitAnd: np.logical_and,
+        ast.BitOr: np.logical_or,
+    }
+
+    _UNARYOPS = {
+        ast.USub: operator.neg,
+        ast.UAdd: operator.pos,
+        ast.Not: np.logical_not,
+        ast.Invert: np.logical_not,
+    }
+
+    _CMPOPS = {
+        ast.Eq: operator.eq,
+        ast.NotEq: operator.ne,
+        ast.Lt: operator.lt,
+        ast.LtE: operator.le,
+        ast.Gt: operator.gt,
+        ast.GtE: operator.ge,
+    }
+
+    _BOOLOPS = {
+        ast.And: np.logical_and,
+        ast.Or: np.logical_or,
+    }
+
+    def __init__(self, text):
+        """
+        Args:
+            text: string with the expression. A SyntaxError is raised
+                if it can not be parsed and an Exception if it contains
+                elements that are not allowed.
+        """
+        self.text = text
+        self._tree = ast.parse(text.strip(), mode='eval').body
+        self.names = Expression.getNames(text)
+        self._validate(self._tree)
+
+    def __str__(self):
+        return self.text
+
+    @staticmethod
+    def getNames(text):
+        """ Return the list of column names referenced in the expression. """
+        tree = ast.parse(text.strip(), mode='eval')
+        funcs = {id(n.func) for n in ast.walk(tree) if isinstance(n, ast.Call)}
+        names = []
+        for n in ast.walk(tree):
+            if (isinstance(n, ast.Name) and id(n) not in funcs
+                    and n.id not in Expression.CONSTANTS
+                    and n.id not in names):
+                names.append(n.id)
+        return names
+
+    def _validate(self, node):
+        """ Raise an Exception if the node is not allowed. Return its value
+        if it does not depend on any column, or _NOT_CONSTANT. """
+        if isinstance(node, ast.BinOp):
+            self._checkOp(node.op, self._BINOPS)
+            values = [self._validate(node.left), self._validate(node.right)]
+            self._checkSize(node.op, *values)
+        elif isinstance(node, ast.UnaryOp):
+            self._checkOp(node.op, self._UNARYOPS)
+            values = [self._validate(node.operand)]
+        elif isinstance(node, ast.Compare):
+            for op in node.ops:
+                self._checkOp(op, self._CMPOPS)
+            values = [self._validate(n) for n in [node.left] + node.comparators]
+        elif isinstance(node, ast.BoolOp):
+            self._checkOp(node.op, self._BOOLOPS)
+            values = [self._validate(n) for n in node.values]
+        elif isinstance(node, ast.Call):
+            if (not isinstance(node.func, ast.Name)
+                    or node.func.id not in self.FUNCTIONS):
+                raise Exception("Invalid function in expression: '%s'"
+                                % _nodeName(node.func))
+            if node.keywords:
+                raise Exception("Keyword arguments are not allowed "
+                                "in expression: '%s'" % self.text)
+            values = [self._validate(n) for n in node.args]
+        elif isinstance(node, ast.Constant):
+            if not isinstance(node.value, (int, float, str)):
+                raise Exception("Invalid constant in expression: '%s'"
+                                % self.text)
+            return node.value
+        elif isinstance(node, ast.Name):
+            return self.CONSTANTS.get(node.id, _NOT_CONSTANT)
+        else:
+            raise Exception("Invalid element '%s' in expression: '%s'"
+                            % (type(node).__name__, self.text))
+
+        if any(v is _NOT_CONSTANT for v in values):
+            return _NOT_CONSTANT
+        try:
+            return self._eval(node, None)
+        except Exception:  # Errors will be raised when evaluating
+            return _NOT_CONSTANT
+
+    def _checkSize(self, op, left, right):
+        """ Raise an Exception if the operation with constant values would
+        create a huge integer or string (e.g. 9**9**9 or 'x' * 10**9). """
+        if isinstance(op, ast.Pow):
+            if (_isInt(left) and _isInt(right) and right > 0
+                    and right * abs(int(left)).bit_length() > self.MAX_INT_BITS):
+                raise Exception("Too large power in expression: '%s'"
+                                % self.text)
+        elif isinstance(op, ast.Mult):
+            for v, n in [(left, right), (right, left)]:
+                if (isinstance(v, str) and _isInt(n)
+                        and len(v) * n > self.MAX_STR_LENGTH):
+                    raise Exception("Too long string in expression: '%s'"
+                                    % self.text)
+
+    def _checkOp(self, op, opsDict):
+        if type(op) not in opsDict:
+            raise Exception("Invalid operator '%s' in expression: '%s'"
+                            % (type(op).__name__, self.text))
+
+    def evaluate(self, getColumn):
+        """ Evaluate the expression.
+
+        Args:
+            getColumn: callable that receives a column name and should
+                return the numpy array with the column values.
+
+        Return:
+            The resulting numpy array, or a scalar if the expression
+            does not reference any column.
+        """
+        return self._eval(self._tree, getColumn)
+
+    def _eval(self, node, getColumn):
+        if isinstance(node, ast.Constant):
+            return node.value
+        elif isinstance(node, ast.Name):
+            if node.id in self.CONSTANTS:
+                return self.CONSTANTS[node.id]
+            return getColumn(node.id)
+        elif isinstance(node, ast.BinOp):
+            return self._BINOPS[type(node.op)](self._eval(node.left, getColumn),
+                                               self._eval(node.right, getColumn))
+        elif isinstance(node, ast.UnaryOp):
+            return self._UNARYOPS[type(node.op)](self._eval(node.operand,
+                                                            getColumn))
+        elif isinstance(node, ast.Compare):
+            # Chained comparisons: a < b < c  -> (a < b) & (b < c)
+            left = self._eval(node.left, getColumn)
+            result = True
+            for op, n in zip(node.ops, node.comparators):
+                right = self._eval(n, getColumn)
+                result = np.logical_and(result,
+                                        self._CMPOPS[type(op)](left, right))
+                left = right
+            return result
+        elif isinstance(node, ast.BoolOp):
+            values = [self._eval(n, getColumn) for n in node.values]
+            result = values[0]
+            for v in values[1:]:
+                result = self._BOOLOPS[type(node.op)](result, v)
+            return result
+        elif isinstance(node, ast.Call):
+            args = [self._eval(n, getColumn) for n in node.args]
+            return self.FUNCTIONS[node.func.id](*args)
@@ -0,0 +1,143 @@
+# **************************************************************************
+# *
+# * Authors:     J.M. de la Rosa Trevin (delarosatrevin@gmail.com)
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 3 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# **************************************************************************
+
+import os
+import time
+
+from emtools.utils import FileWatcher
+
+
+class MonitorGroup:
+    """
+    Update many monitors (e.g. StarMonitor, SetMonitor) from a single
+    thread and yield the new items found by each of them.
+
+    Each monitor is updated with its own interval. After new items are
+    found, the interval is set to minWait, and it is increased by the
+    backoff factor (up to maxWait) while no new items arrive. If inotify
+    is available, monitors are also updated as soon as their files change.
+
+    Example:
+        group = MonitorGroup(StarMonitor(...), StarMonitor(...))
+        for monitor, newRows in group.events():
+            ...
+    """
+    def __init__(self, *monitors, **kwargs):
+        """
+        Args:
+            monitors: initial monitors in the group, more can be added later.
+            kwargs:
+                minWait=1, seconds between updates of an active monitor.
+                maxWait=60, maximum seconds between updates.
+                backoff=2, factor to increase the wait of idle monitors.
+                watch=True, use a FileWatcher to update monitors
+                    when their files are modified.
+        """
+        self.minWait = kwargs.get('minWait', 1)
+        self.maxWait = kwargs.get('maxWait', 60)
+        self.backoff = kwargs.get('backoff', 2)
+
+        self._watcher = None
+        if kwargs.get('watch', True):
+            watcher = FileWatcher()
+            # Only use it with inotify, when polling, monitors' intervals
+            # are better than checking all files every second
+            if watcher.usingInotify():
+                self._watcher = watcher
+            else:
+                watcher.close()
+
+        self._entries = []
+        for monitor in monitors:
+            self.add(monitor)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def add(self, monitor, path=None):
+        """ Add a new monitor to the group.
+
+        Args:
+            monitor: object with an update() method returning the new items.
+            path: file monitored, by default the 'fileName' (or
+                '_filename') attribute of the monitor.
+        """
+        path = (path or getattr(monitor, 'fileName', None)
+                or getattr(monitor, '_filename', None))
+        if path:
+            path = os.path.abspath(path)
+            if self._watcher:
+                self._watcher.add(path)
+
+        self._entries.append({
+            'monitor': monitor,
+            'path': path,
+            'interval': self.minWait,
+            'next': 0  # Update as soon as possible
+        })
+
+    def events(self):
+        """ Yield (monitor, newItems) when new items are found by any
+        monitor, until all of them are done (i.e. timed out or the
+        stream is closed).
+        """
+        while self._entries:
+            entry = min(self._entries, key=lambda e: e['next'])
+            delay = entry['next'] - time.time()
+
+            if delay > 0:
+                if self._watcher:
+                    changed = self._watcher.wait(timeout=delay)
+                    for e in self._entries:
+                        if e['path'] in changed:
+                            e['next'] = 0
+                else:
+                    time.sleep(delay)
+                continue
+
+            monitor = entry['monitor']
+            newItems = monitor.update()
+            if newItems:
+                entry['interval'] = self.minWait
+            else:
+                entry['interval'] = min(entry['interval'] * self.backoff,
+                                        self.maxWait)
+            entry['next'] = time.time() + entry['interval']
+
+            if _isDone(monitor):
+                self._entries.remove(entry)
+
+            if newItems:
+                yield monitor, newItems
+
+    def close(self):
+        if self._watcher:
+            self._watcher.close()
+            self._watcher = None
+
+
+def _isDone(monitor):
+    """ Return True if the monitor will not produce more items. """
+    if getattr(monitor, 'streamClosed', False):
+        return True
+    timedOut = getattr(monitor, 'timedOut', None)
+    return timedOut is not None and timedOut()
@@ -0,0 +1,183 @@
+# **************************************************************************
+# *
+# * Authors:     J.M. de la Rosa Trevin (delarosatrevin@gmail.com)
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 3 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# **************************************************************************
+
+import numpy as np
+
+
+class SeenKeys:
+    """
+    Keep track of the items already seen by a monitor.
+
+    This is the basic implementation, storing the keys in a Python set.
+    Subclasses can store the keys in a more compact way. All of them
+    are used through filterNew(), that receive the keys of a group of
+    consecutive items and the index of the first one in the stream.
+    """
+    def __init__(self):
+        self._keys = set()
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __contains__(self, key):
+        return key in self._keys
+
+    def update(self, keys):
+        """ Mark these keys as seen. """
+        self._keys.update(keys)
+
+    def filterNew(self, keys, start=0):
+        """ Return a list of booleans with True for the keys not seen
+        before, and mark all of them as seen.
+
+        Args:
+            keys: keys of consecutive items in the stream.
+            start: index of the first item in the stream.
+        """
+        mask = []
+        for key in keys:
+            new = key not in self._keys
+            if new:
+                self._keys.add(key)
+            mask.append(new)
+        return mask
+
+
+class HashedSeenKeys(SeenKeys):
+    """
+    Store 64 bits hashes of the keys in a sorted numpy array.
+
+    It uses 8 bytes per item, no matter how long the keys are (e.g.
+    rlnImageName strings). Keys are hashed and checked with numpy
+    operations for all the new items at once.
+    """
+    def __init__(self):
+        self._hashes = np.empty(0, dtype=np.uint64)
+
+    def __len__(self):
+        return self._hashes.size
+
+    def __contains__(self, key):
+        return bool(self._findNew(_hashKeys([key]))[0] < 0)
+
+    def _findNew(self, hashes):
+        """ Return the positions where unique hashes not already in
+        the store should be inserted (-1 for the existing ones). """
+        i = np.searchsorted(self._hashes, hashes)
+        found = np.zeros(hashes.size, dtype=bool)
+        valid = i < self._hashes.size
+        found[valid] = self._hashes[i[valid]] == hashes[valid]
+        i[found] = -1
+        return i
+
+    def _insert(self, hashes, positions):
+        new = positions >= 0
+        self._hashes = np.insert(self._hashes, positions[new], hashes[new])
+        return new
+
+    def update(self, keys):
+        unique = np.unique(_hashKeys(keys))
+        self._insert(unique, self._findNew(unique))
+
+    def filterNew(self, keys, start=0):
+        hashes = _hashKeys(keys)
+        # Only the first occurrence of a key in the group can be new
+        unique, first = np.unique(hashes, return_index=True)
+        new = self._insert(unique, self._findNew(unique))
+        mask = np.zeros(hashes.size, dtype=bool)
+        mask[first[new]] = True
+        return mask.tolist()
+
+
+class SeenRowCount(SeenKeys):
+    """
+    Keep only the number of rows seen, for append-only streams.
+
+    Items are never removed or reordered in these streams, so an
+    item is new if its index is after the last seen one. Keys are
+    not used at all.
+    """
+    def __init__(self):
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def __contains__(self, key):
+        raise Exception("Keys are not stored by SeenRowCount")
+
+    def update(self, keys):
+        """ Mark the first len(keys) rows as seen. """
+        self.count = max(self.count, len(keys))
+
+    def filterNew(self, keys, start=0):
+        n = len(keys)
+        mask = [start + i >= self.count for i in range(n)]
+        self.count = max(self.count, start + n)
+        return mask
+
+
+_FNV_OFFSET = np.uint64(0xcbf29ce484222325)
+_FNV_PRIME = np.uint64(0x100000001b3)
+_INT_MIN, _INT_MAX = -2**63, 2**63 - 1
+
+
+def _hashKeys(keys):
+    """ Compute 64 bits hashes for a list of keys.
+    Integer keys are mixed with a splitmix64 step and other keys are
+    hashed from their string representation with FNV-1a, processing one
+    character position for all keys at once. The hash of each key does
+    not depend on the other keys in the list.
+    """
+    if isinstance(keys, np.ndarray) and keys.dtype.kind in 'iu':
+        if keys.dtype.kind == 'i' or not keys.size or keys.max() <= _INT_MAX:
+            return _hashInts(keys)
+        keys = keys.tolist()
+
+    n = len(keys)
+    # Integers out of the int64 range are hashed as strings
+    isInt = np.fromiter((isinstance(k, (int, np.integer))
+                         and _INT_MIN <= k <= _INT_MAX for k in keys),
+                        dtype=bool, count=n)
+    if isInt.all():
+        return _hashInts(np.fromiter(keys, dtype=np.int64, count=n))
+
+    h = _hashStrings([str(k).encode() for k in keys])
+    if isInt.any():
+        h[isInt] = _hashInts(np.fromiter(
+            (k for k, i in zip(keys, isInt) if i), dtype=np.int64))
+    return h
+
+
+def _hashInts(keys):
+    h = keys.astype(np.uint64)
+    h = (h ^ (h >> np.uint64(30))) * np.uint64(0xbf58476d1ce4e5b9)
+    h = (h ^ (h >> np.uint64(27))) * np.uint64(0x94d049bb133111eb)
+    return h ^ (h >> np.uint64(31))
+
+
+def _hashStrings(encoded):
+    n = len(encoded)
+    h = np.full(n, _FNV_OFFSET, dtype=np.uint64)
+    if n:
+        lengths = np.fromiter(map(len, encoded), dtype=np.int64, count=n)
+        chars = np.array(encoded, dtype=bytes)
+        chars = chars.view(np.uint8).reshape(n, chars.itemsize)
+        # Only hash the bytes of each key, not the padding of shorter
+        # keys, so the hash does not depend on the other keys
+        for i in range(chars.shape[1]):
+            h = np.where(i < lengths, (h ^ chars[:, i]) * _FNV_PRIME, h)
+    return h
@@ -19,25 +19,61 @@
 # *
 # **************************************************************************
 
+import os
+import re
 import time
+import heapq
+import itertools
 from contextlib import AbstractContextManager
+from datetime import datetime, timedelta
 import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from operator import itemgetter
+from urllib.parse import quote
+
+import numpy as np
+
+from emtools.utils import FileWatcher
+from .table import _toArray
+
+_IDENTIFIER_RE = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*$')
+# String literals or names (that can contain dots for Scipion labels)
+_NAMES_RE = re.compile(r"'[^']*'|\"[^\"]*\"|[A-Za-z_][\w.]*")
+# Value of the '_streamState' property of closed sets (Set.STREAM_CLOSED)
+_STREAM_CLOSED = 2
 
 
 class SqliteFile(AbstractContextManager):
     """
     Class to manipulate Scipion Set Sqlite files.
     """
-    def __init__(self, inputFile, mode='r'):
+    def __init__(self, inputFile, mode='r', **kwargs):
         """
         Args:
             inputFile: can be a str with the file path or a file object.
             mode: mode to open the file, if inputFile is already a file,
                 the mode will be ignored.
+            kwargs:
+                pooled=False, if True, take the connection from the shared
+                    pool and return it there on close, so following
+                    SqliteFile instances can reuse it (and its page cache).
+                immutable=False, open the file as immutable, without any
+                    locking or change detection. Only use it for files
+                    that will not be modified (e.g. finished sets).
+                mmapSize, cacheSize: bytes used for memory mapped I/O and
+                    for the page cache of the connection.
         """
         self._names = []
         self._file = inputFile
-        self._con = sqlite3.connect(f"file:{inputFile}?mode=ro", uri=True)
+        self._columnsMaps = {}  # Cache mappings read from classes tables
+        self._options = {k: kwargs[k] for k in
+                         ['immutable', 'mmapSize', 'cacheSize'] if k in kwargs}
+        self._pooled = kwargs.get('pooled', False)
+        if self._pooled:
+            self._con = SqliteFile.pool.acquire(inputFile, **self._options)
+        else:
+            self._con = _connect(inputFile, **self._options)
         self._con.row_factory = self._dict_factory
 
     def __exit__(self, exc_type, exc_val, exc_tb):
@@ -68,7 +104,8 @@ class SqliteFile(AbstractContextManager):
         This method is much more efficient that parsing the table
         and getting the size, if the size what is important.
         """
-        return self._con.execute(f"SELECT COUNT(*) FROM {tableName}").fetchone()['COUNT(*)']
+        query = f"SELECT COUNT(*) FROM {_checkIdentifier(tableName)}"
+        return self._con.execute(query).fetchone()['COUNT(*)']
 
     def iterTable(self, tableName, **kwargs):
         """ Only iterate over the table's rows and do not create
@@ -76,70 +113,784 @@ class SqliteFile(AbstractContextManager):
         Args:
             tableName: the name of the table to read, it can be the empty string
             kwargs:
+                columns: list of columns to read, by default all of them
+                where: condition to filter rows, values should be passed
+                    with '?' placeholders, e.g: where='_micId = ?'
+                params: values for the placeholders in the where condition
+                orderBy: column (or list of columns) to sort the rows,
+                    optionally followed by ASC or DESC
                 start: starting index, first one is 0
                 limit: limit to this number of elements
-                classes: read column names from a 'classes' table
+                classes: read column names from a 'classes' table, labels
+                    can also be used in columns, where and orderBy.
+                chunkSize: number of rows to fetch at once (default 1000)
         """
-        where = kwargs.get('where', '1')
-        query = f"SELECT * FROM {tableName} WHERE {where}"
+        query, params = self._buildQuery(tableName, **kwargs)
+        cursor = self._execute(query, params, kwargs.get('classes', None))
+        cursor.arraysize = kwargs.get('chunkSize', 1000)
+        while rows := cursor.fetchmany():
+            yield from rows
+        cursor.close()
 
-        if 'start' in kwargs and 'limit' not in kwargs:
-            kwargs['limit'] = -1
+    def getColumnArrays(self, tableName, columns, where=None, **kwargs):
+        """ Read the values of some columns of a table into numpy arrays.
 
-        if 'limit' in kwargs:
-            query += f" LIMIT {kwargs['limit']}"
+        Rows are fetched in chunks as tuples, which is much faster than
+        iterating the table when many rows are needed.
 
-        if 'start' in kwargs:
-            query += f" OFFSET {kwargs['start']}"
+        Args:
+            tableName: the name of the table to read.
+            columns: list with the names of the columns to read.
+            where: optional condition to filter rows.
+            kwargs:
+                params, orderBy, classes: as in iterTable
+                chunkSize: number of rows to fetch at once (default 100000)
 
-        if 'classes' not in kwargs:
-            res = self._con.execute(query)
-            while row := res.fetchone():
-                yield row
-        else:
-            columnsMap = {row['column_name']: row['label_property']
-                          for row in self.iterTable(kwargs['classes'])}
+        Return:
+            A dict with {columnName: numpy array} for each column.
+        """
+        query, params = self._buildQuery(tableName, columns=columns,
+                                         where=where, **kwargs)
+        cursor = self._con.cursor()
+        cursor.row_factory = None  # Use tuples
+        cursor.arraysize = kwargs.get('chunkSize', 100000)
+        cursor.execute(query, params)
+        values = [[] for _ in columns]
+        getters = [itemgetter(i) for i in range(len(columns))]
+        while rows := cursor.fetchmany():
+            for colValues, getter in zip(values, getters):
+                colValues.extend(map(getter, rows))
+        cursor.close()
 
-            def _row_factory(cursor, row):
-                fields = [column[0] for column in cursor.description]
-                return {columnsMap.get(k, k): v for k, v in zip(fields, row)}
+        return {c: _toArray(v, None) for c, v in zip(columns, values)}
 
-            # Modify row factory to modify column names
-            self._con.row_factory = _row_factory
-            res = self._con.execute(query)
-            while row := res.fetchone():
-                yield row
-            # Restore row factory
-            self._con.row_factory = self._dict_factory
+    def _buildQuery(self, tableName, **kwargs):
+        """ Build the SELECT query and its parameters from the
+        iterTable arguments. Table and column names are validated,
+        values should be passed as parameters. """
+        labelsMap = {}
+        if kwargs.get('classes', None):
+            labelsMap = {label: column for column, label
+                         in self._getColumnsMap(kwargs['classes']).items()}
+
+        def _column(name):
+            return _checkIdentifier(labelsMap.get(name, name))
+
+        columns = kwargs.get('columns', None)
+        select = ', '.join(_column(c) for c in columns) if columns else '*'
+        query = f"SELECT {select} FROM {_checkIdentifier(tableName)}"
+        params = list(kwargs.get('params', None) or [])
+
+        where = kwargs.get('where', None)
+        if where:
+            query += f" WHERE {_mapNames(where, labelsMap)}"
+
+        orderBy = kwargs.get('orderBy', None)
+        if orderBy:
+            terms = [f"{_column(name)} {order}"
+                     for name, order in _parseOrderBy(orderBy)]
+            query += f" ORDER BY {', '.join(terms)}"
+
+        if 'start' in kwargs or 'limit' in kwargs:
+            query += " LIMIT ? OFFSET ?"
+            params.extend([kwargs.get('limit', -1), kwargs.get('start', 0)])
+
+        return query, params
 
     def getTableRow(self, tableName, rowIndex, **kwargs):
-        """ Get a given row by index. Extra args are passed to iterTable. """
+        """ Get a given row by index. Extra args are passed to iterTable.
+        Rows before the index need to be read, so getTableRowById is
+        much faster for large tables. """
         kwargs['start'] = rowIndex
         kwargs['limit'] = 1
         for row in self.iterTable(tableName, **kwargs):
             return row
 
+    def getTableRowById(self, tableName, rowId, **kwargs):
+        """ Get a given row by its id, using the primary key index.
+
+        Args:
+            tableName: the name of the table to read.
+            rowId: the value of the 'id' column.
+            kwargs:
+                classes: read column names from a 'classes' table
+        """
+        query = f"SELECT * FROM {_checkIdentifier(tableName)} WHERE id = ?"
+        cursor = self._execute(query, (rowId,), kwargs.get('classes', None))
+        return cursor.fetchone()
+
+    def iterTableChunks(self, tableName, chunkSize=10000, afterId=None,
+                        **kwargs):
+        """ Iterate over the rows of a table in chunks (lists of rows),
+        ordered by id.
+
+        Each chunk is read starting after the last id of the previous one
+        (keyset pagination), so the cost of reading each chunk does not
+        depend on its position in the table, unlike using LIMIT/OFFSET.
+
+        Args:
+            tableName: the name of the table to read.
+            chunkSize: maximum number of rows in each chunk.
+            afterId: if not None, only read rows with id > afterId.
+            kwargs:
+                untilId: if not None, only read rows with id <= untilId,
+                    useful to split the table by id ranges.
+                classes: read column names from a 'classes' table
+        """
+        query = f"SELECT * FROM {_checkIdentifier(tableName)} WHERE id > ?"
+        untilId = kwargs.get('untilId', None)
+        params = []
+        if untilId is not None:
+            query += " AND id <= ?"
+            params.append(untilId)
+        query += " ORDER BY id LIMIT ?"
+        params.append(chunkSize)
+
+        classes = kwargs.get('classes', None)
+        idKey = self._getColumnsMap(classes).get('id', 'id') if classes else 'id'
+        # Smallest 64 bits integer, to start before any id
+        lastId = -2 ** 63 if afterId is None else afterId
+
+        while True:
+            rows = self._execute(query, [lastId] + params, classes).fetchall()
+            if rows:
+                yield rows
+            if len(rows) < chunkSize:
+                break
+            lastId = rows[-1][idKey]
+
+    def iterTables(self, tables, workers=4, **kwargs):
+        """ Read several tables concurrently. Each table is read from a
+        different thread, using its own connection from the pool.
+
+        Args:
+            tables: list of table names, or dict with {tableName: kwargs}
+                to pass specific iterTable arguments for each table.
+            workers: number of threads to use.
+            kwargs: iterTable arguments used for all tables.
+
+        Return:
+            Iterator over (tableName, rows) tuples, in the same order
+            of the input tables.
+        """
+        if not isinstance(tables, dict):
+            tables = {t: {} for t in tables}
+
+        # Read classes tables only once for all threads
+        for tableArgs in tables.values():
+            classes = tableArgs.get('classes', kwargs.get('classes', None))
+            if classes:
+                self._getColumnsMap(classes)
+
+        def _read(tableName):
+            tableArgs = dict(kwargs, **tables[tableName])
+            return tableName, self._readTable(tableName, **tableArgs)
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            yield from executor.map(_read, tables)
+
+    def _readTable(self, tableName, **kwargs):
+        """ Return all rows of a table read with a new connection from
+        the pool, used by iterTables from different threads. """
+        with SqliteFile(self._file, pooled=True, **self._options) as sf:
+            sf._columnsMaps = self._columnsMaps
+            return list(sf.iterTable(tableName, **kwargs))
+
+    def _execute(self, query, params=(), classes=None):
+        """ Execute the query in a new cursor, returning rows as dicts.
+        Column names are read from the classes table if not None. """
+        cursor = self._con.cursor()
+        columnsMap = self._getColumnsMap(classes) if classes else None
+        cursor.row_factory = _dictFactory(columnsMap)
+        cursor.execute(query, params)
+        return cursor
+
     def close(self):
         if getattr(self, '_con', None):
-            self._con.close()
+            if self._pooled:
+                SqliteFile.pool.release(self._con)
+            else:
+                self._con.close()
             self._con = None
 
-    def _dict_factory(self, cursor, row):
+    def _getColumnsMap(self, classesTable):
+        """ Return a dict {column_name: label_property} from the
+        classes table. It is read only once for each SqliteFile. """
+        if classesTable not in self._columnsMaps:
+            self._columnsMaps[classesTable] = {
+                row['column_name']: row['label_property']
+                for row in self.iterTable(classesTable)}
+        return self._columnsMaps[classesTable]
+
+    @staticmethod
+    def _dict_factory(cursor, row):
         fields = [column[0] for column in cursor.description]
         return {key: value for key, value in zip(fields, row)}
 
     @staticmethod
-    def copyDb(inputFile, outputFile, tries=1, wait=10):
+    def union(paths, tables=('Objects',), **kwargs):
+        """ Return a SqliteCollection to read the given tables from
+        all files as if they were one (see SqliteCollection). """
+        return SqliteCollection(paths, tables=tables, **kwargs)
+
+    @staticmethod
+    def copyDb(inputFile, outputFile, tries=1, wait=10, **kwargs):
         """ Make a copy of the db using Sqlite's backup API.
-        This way it will lock the db if other processes are using it. """
-        while tries:
+        This way it will lock the db if other processes are using it.
+
+        The copy is skipped if the input db has not been modified since
+        the last copy to the same output file (the output file gets the
+        modification time of the input). Pages are copied in steps, so
+        the input db is only locked for a short time on each step.
+
+        Args:
+            inputFile: the db file to copy.
+            outputFile: where to copy the db.
+            tries: number of times to try if the db is busy.
+            wait: seconds to wait before trying again, it will be
+                doubled after each try.
+            kwargs:
+                force=False, copy even if the input has not changed.
+                pages=1024, number of pages to copy on each step.
+                progress=None, callback(status, remaining, total) to be
+                    called after each step.
+
+        Return:
+            True if the db was copied, False if it had not changed.
+        """
+        mTime = _getMTime(inputFile)
+        if (not kwargs.get('force', False) and os.path.exists(outputFile)
+                and os.stat(outputFile).st_mtime_ns == mTime):
+            return False
+
+        def _copy():
+            inputDb = _connect(inputFile)
+            outputDb = sqlite3.connect(outputFile)
             try:
-                inputDb = sqlite3.connect(inputFile)
-                outputDb = sqlite3.connect(outputFile)
-                inputDb.backup(outputDb)
+                inputDb.backup(outputDb, pages=kwargs.get('pages', 1024),
+                               progress=kwargs.get('progress', None))
+            finally:
                 inputDb.close()
                 outputDb.close()
-                tries = 0  # No need for more tries
-            except:
-                tries -= 1
-                time.sleep(wait)
+
+        _retryBusy(_copy, tries=tries, wait=wait, maxWait=8 * wait)
+        # If the input was modified while copying, its time will be newer
+        os.utime(outputFile, ns=(mTime, mTime))
+        return True
+
+
+class SqliteCollection(SqliteFile):
+    """
+    Read many sqlite files with the same tables as if they were one,
+    e.g. all the sets produced by batches of a streaming project.
+
+    Files are attached to an in-memory database and a UNION ALL view is
+    created for each table, so queries (filtering, sorting, etc) run
+    inside SQLite. SQLite limits the number of attached files (usually
+    10), so files are read in batches of that size. In that case, rows
+    of all batches are merged to keep the orderBy, and start and limit
+    apply to all rows.
+
+    Ids are not unique across files, so reading rows by id is not
+    supported (the 'sourceColumn' can be used to know the file of
+    each row).
+
+    All files should have the same columns for the given tables.
+    """
+    def __init__(self, paths, tables=('Objects',), **kwargs):
+        """
+        Args:
+            paths: list of sqlite files.
+            tables: names of the tables that will be read from all files,
+                other tables (e.g. Classes) are read from the first file.
+            kwargs:
+                batchSize: maximum number of files attached at once,
+                    by default the limit of SQLite.
+                sourceColumn: if not None, add a column with this name
+                    and the index of the file of each row.
+        """
+        self._paths = [os.path.abspath(p) for p in paths]
+        if not self._paths:
+            raise Exception("At least one file is needed for a collection")
+        self._tables = list(tables)
+        self._sourceColumn = kwargs.get('sourceColumn', None)
+        self._file = self._paths[0]
+        self._names = []
+        self._columnsMaps = {}
+        self._options = {}
+        self._pooled = False
+        self._con = None
+
+        con = sqlite3.connect(':memory:')
+        limit = _getAttachLimit(con)
+        con.close()
+        self._batchSize = min(kwargs.get('batchSize', limit), limit)
+
+    def __len__(self):
+        return len(self._paths)
+
+    def getTableNames(self):
+        if not self._names:
+            with SqliteFile(self._file) as sf:
+                self._names = sf.getTableNames()
+        return self._names
+
+    def getTableSize(self, tableName):
+        total = 0
+        for batch in self._iterBatches(tableName):
+            total += batch.getTableSize(tableName)
+        return total
+
+    def iterTable(self, tableName, **kwargs):
+        """ Iterate over the rows of the table in all files,
+        see SqliteFile.iterTable for the arguments. """
+        starts = self._batchStarts(tableName)
+        if len(starts) == 1:
+            for batch in self._iterBatches(tableName):
+                yield from batch.iterTable(tableName, **kwargs)
+            return
+
+        # Each batch is read from the beginning, start and limit
+        # are applied to the rows of all batches
+        start = kwargs.pop('start', 0)
+        limit = kwargs.pop('limit', -1)
+        end = None if limit is None or limit < 0 else start + limit
+        if end is not None:
+            kwargs['limit'] = end  # No batch needs more rows than this
+
+        orderBy = kwargs.get('orderBy', None)
+        if not orderBy:
+            rows = itertools.chain.from_iterable(
+                batch.iterTable(tableName, **kwargs)
+                for batch in self._iterBatches(tableName))
+            yield from itertools.islice(rows, start, end)
+            return
+
+        # Rows should contain the orderBy columns to be merged
+        terms = _parseOrderBy(orderBy)
+        classes = kwargs.get('classes', None)
+        labels = self._getColumnsMap(classes) if classes else {}
+        keys = [(labels.get(name, name), order) for name, order in terms]
+        columns = kwargs.get('columns', None)
+        extra = []
+        if columns:
+            columns = list(columns)
+            extra = [name for name, _ in terms
+                     if name not in columns and labels.get(name) not in columns]
+            kwargs['columns'] = columns + extra
+        extraKeys = [labels.get(name, name) for name in extra]
+
+        # All batches need to be open at the same time to merge them
+        batches = [self._openBatch(i) for i in starts]
+        try:
+            rows = heapq.merge(*[b.iterTable(tableName, **kwargs)
+                                 for b in batches], key=_rowSortKey(keys))
+            for row in itertools.islice(rows, start, end):
+                for k in extraKeys:
+                    del row[k]
+                yield row
+        finally:
+            for batch in batches:
+                batch.close()
+
+    def getColumnArrays(self, tableName, columns, where=None, **kwargs):
+        if len(self._batchStarts(tableName)) > 1 and (
+                kwargs.get('orderBy', None)
+                or 'start' in kwargs or 'limit' in kwargs):
+            # Rows of all batches need to be merged, see iterTable
+            rows = list(self.iterTable(tableName, columns=columns,
+                                       where=where, **kwargs))
+            return {c: _toArray([row[c] for row in rows], None)
+                    for c in columns}
+
+        batches = [batch.getColumnArrays(tableName, columns, where=where,
+                                         **kwargs)
+                   for batch in self._iterBatches(tableName)]
+        return {c: np.concatenate([arrays[c] for arrays in batches])
+                for c in columns}
+
+    def getTableRowById(self, tableName, rowId, **kwargs):
+        raise NotImplementedError("getTableRowById is not supported for "
+                                  "collections, ids are not unique across "
+                                  "files.")
+
+    def iterTableChunks(self, tableName, chunkSize=10000, afterId=None,
+                        **kwargs):
+        raise NotImplementedError("iterTableChunks is not supported for "
+                                  "collections, ids are not unique across "
+                                  "files.")
+
+    def _readTable(self, tableName, **kwargs):
+        # Batches are attached with new connections, so tables
+        # can be read from different threads
+        return list(self.iterTable(tableName, **kwargs))
+
+    def _getColumnsMap(self, classesTable):
+        if classesTable not in self._columnsMaps:
+            with SqliteFile(self._file) as sf:
+                self._columnsMaps[classesTable] = sf._getColumnsMap(
+                    classesTable)
+        return self._columnsMaps[classesTable]
+
+    def _batchStarts(self, tableName):
+        """ Return the index of the first file of each batch. Only the
+        first batch is used for tables not read from all files. """
+        n = len(self._paths) if tableName in self._tables else 1
+        return range(0, n, self._batchSize)
+
+    def _openBatch(self, first):
+        """ Return a SqliteFile reading the views of the batch of files
+        starting with the given index. """
+        batch = SqliteFile.__new__(SqliteFile)
+        batch._file = self._paths[first]
+        batch._names = []
+        batch._columnsMaps = self._columnsMaps
+        batch._options = {}
+        batch._pooled = False
+        paths = self._paths[first:first + self._batchSize]
+        batch._con = self._attach(first, paths)
+        return batch
+
+    def _iterBatches(self, tableName):
+        """ Open each batch of files, the connection is closed after
+        each batch is read. """
+        for first in self._batchStarts(tableName):
+            batch = self._openBatch(first)
+            try:
+                yield batch
+            finally:
+                batch.close()
+
+    def _attach(self, first, paths):
+        # Use URI to allow attaching files in read-only mode
+        con = sqlite3.connect('file::memory:', uri=True,
+                              check_same_thread=False)
+        con.row_factory = self._dict_factory
+        schemas = []
+        for i, path in enumerate(paths):
+            schema = f'db{i}'
+            con.execute(f"ATTACH DATABASE ? AS {schema}",
+                        (f"file:{quote(path)}?mode=ro",))
+            schemas.append((first + i, schema))
+
+        source = self._sourceColumn
+        if source:
+            _checkIdentifier(source)
+
+        for table in self._tables:
+            table = _checkIdentifier(table)
+            selects = [f"SELECT *{f', {i} AS {source}' if source else ''} "
+                       f"FROM {schema}.{table}" for i, schema in schemas]
+            con.execute(f"CREATE TEMP VIEW {table} AS "
+                        + " UNION ALL ".join(selects))
+
+        # Other tables are read from the first file
+        for table in self.getTableNames():
+            if (table not in self._tables and _IDENTIFIER_RE.match(table)
+                    and not table.startswith('sqlite_')):
+                con.execute(f"CREATE TEMP VIEW {table} AS "
+                            f"SELECT * FROM db0.{table}")
+        return con
+
+    def close(self):
+        pass
+
+
+class SqlitePool:
+    """
+    Pool of read-only connections to sqlite files, that can be used
+    from different threads. Each connection is used only by one thread
+    at a time, between acquire() and release().
+
+    Connections are kept by path and modification time of the file,
+    so connections opened before the file was modified are not used
+    again (needed for immutable connections).
+    """
+    def __init__(self, maxIdle=4):
+        """
+        Args:
+            maxIdle: maximum number of idle connections kept for each file.
+        """
+        self.maxIdle = maxIdle
+        self._lock = threading.Lock()
+        self._idle = {}  # {key: [connections]}
+        self._keys = {}  # {connection: key}
+
+    def acquire(self, path, **options):
+        """ Return a connection to the file, reusing an idle one if
+        possible. Options are passed to open new connections. """
+        path = os.path.abspath(path)
+        key = (path, _getMTime(path), tuple(sorted(options.items())))
+
+        with self._lock:
+            # Close connections opened before the file was modified
+            for k in [k for k in self._idle if k[0] == path and k[1] != key[1]]:
+                for con in self._idle.pop(k):
+                    con.close()
+            idle = self._idle.get(key, None)
+            con = idle.pop() if idle else None
+
+        if con is None:
+            con = _connect(path, **options)
+        with self._lock:
+            self._keys[con] = key
+        return con
+
+    def release(self, con):
+        """ Return the connection to the pool. """
+        with self._lock:
+            key = self._keys.pop(con)
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < self.maxIdle:
+                con.row_factory = SqliteFile._dict_factory
+                idle.append(con)
+                con = None
+        if con is not None:
+            con.close()
+
+    def clear(self):
+        """ Close all idle connections. """
+        with self._lock:
+            for idle in self._idle.values():
+                for con in idle:
+                    con.close()
+            self._idle.clear()
+
+
+# Pool shared by all SqliteFile instances opened with pooled=True
+SqliteFile.pool = SqlitePool()
+
+
+class SqliteMonitor:
+    """
+    Monitor a Scipion Set Sqlite file and return new items of a table.
+
+    Only rows with a key greater than the last one seen are read on each
+    update, so the cost does not depend on the number of items that
+    were already in the set.
+    """
+    def __init__(self, fileName, tableName='Objects', keyColumn='id',
+                 **kwargs):
+        """
+        Args:
+            fileName: path to the sqlite file.
+            tableName: table to monitor.
+            keyColumn: column with increasing values for new rows.
+            kwargs:
+                classes: read column names from a 'classes' table
+                afterKey: only rows with key greater than this value
+                    will be returned, e.g. from a previous run.
+                wait=10, maximum seconds between updates in newItems
+                timeout=300, seconds without new items to consider
+                    the stream done, if the set was not closed
+                tries=10, number of times to try again if the
+                    database is busy.
+        """
+        self.fileName = fileName
+        self._tableName = tableName
+        self._keyColumn = keyColumn
+        self._classes = kwargs.get('classes', None)
+        self._wait = kwargs.get('wait', 10)
+        self._timeout = timedelta(seconds=kwargs.get('timeout', 300))
+        self._tries = kwargs.get('tries', 10)
+        self.lastKey = kwargs.get('afterKey', None)
+        self.lastCheck = None  # Last timestamp when input was checked
+        self.lastUpdate = None  # Last timestamp when new items were found
+        self.inputCount = 0  # Count all input elements
+        self.streamClosed = False
+        self._mTime = None
+        self._keyLabel = keyColumn  # Key name in rows if using classes
+
+    def update(self):
+        """ Return the new rows since the last update. """
+        newRows = []
+        now = datetime.now()
+        mTime = _getMTime(self.fileName)
+
+        if mTime != self._mTime:
+            newRows, self.streamClosed = _retryBusy(self._read,
+                                                    tries=self._tries)
+            self._mTime = mTime
+            if newRows:
+                self.lastKey = newRows[-1][self._keyLabel]
+                self.inputCount += len(newRows)
+
+        self.lastCheck = now
+        if newRows:
+            self.lastUpdate = now
+        return newRows
+
+    def _read(self):
+        """ Read new rows and the stream state of the set. """
+        key = _checkIdentifier(self._keyColumn)
+        query = f"SELECT * FROM {_checkIdentifier(self._tableName)}"
+        params = []
+        if self.lastKey is not None:
+            query += f" WHERE {key} > ?"
+            params.append(self.lastKey)
+        query += f" ORDER BY {key}"
+
+        with SqliteFile(self.fileName, pooled=True) as sf:
+            if self._classes:
+                columnsMap = sf._getColumnsMap(self._classes)
+                self._keyLabel = columnsMap.get(self._keyColumn,
+                                                self._keyColumn)
+            rows = sf._execute(query, params, self._classes).fetchall()
+            row = sf._execute("SELECT value FROM Properties "
+                              "WHERE key = '_streamState'").fetchone()
+        return rows, (row is not None
+                      and str(row['value']).strip() == str(_STREAM_CLOSED))
+
+    def timedOut(self):
+        """ Return True when there has been timeout seconds
+        since last new items were found. """
+        if self.lastCheck is None or self.lastUpdate is None:
+            return False
+        else:
+            return self.lastCheck - self.lastUpdate > self._timeout
+
+    def newItems(self):
+        """ Yield new items since last update until the stream is closed
+        (or timed out). Between updates, it will wait until the file is
+        modified or at most 'wait' seconds.
+        """
+        with FileWatcher(self.fileName) as watcher:
+            while True:
+                for row in self.update():
+                    yield row
+                if self.streamClosed or self.timedOut():
+                    break
+                watcher.wait(timeout=self._wait)
+
+
+def _connect(path, immutable=False, mmapSize=256 * 1024 ** 2,
+             cacheSize=64 * 1024 ** 2):
+    """ Open a read-only connection to the sqlite file. """
+    uri = f"file:{quote(os.path.abspath(path))}?mode=ro"
+    if immutable:
+        uri += "&immutable=1"
+    con = sqlite3.connect(uri, uri=True, check_same_thread=False)
+    con.execute(f"PRAGMA mmap_size = {int(mmapSize)}")
+    # Negative cache size is in KiB instead of pages
+    con.execute(f"PRAGMA cache_size = {-int(cacheSize) // 1024}")
+    con.execute("PRAGMA query_only = 1")
+    return con
+
+
+def _dictFactory(columnsMap=None):
+    """ Return a row factory to create dicts for a cursor. Field names
+    are computed once, from the first row, and optionally renamed with
+    columnsMap. """
+    fields = None
+
+    def _factory(cursor, row):
+        nonlocal fields
+        if fields is None:
+            fields = [c[0] for c in cursor.description]
+            if columnsMap:
+                fields = [columnsMap.get(f, f) for f in fields]
+        return dict(zip(fields, row))
+
+    return _factory
+
+
+def _getAttachLimit(con):
+    """ Return the maximum number of databases that can be attached. """
+    if hasattr(con, 'getlimit'):  # Python >= 3.11
+        return con.getlimit(sqlite3.SQLITE_LIMIT_ATTACHED)
+    return 10  # SQLite default
+
+
+def _parseOrderBy(orderBy):
+    """ Return a list of (name, order) pairs from the orderBy argument
+    of SqliteFile.iterTable, order is ASC or DESC. """
+    terms = []
+    for term in [orderBy] if isinstance(orderBy, str) else orderBy:
+        parts = term.split()
+        if not parts or len(parts) > 2 or (
+                len(parts) == 2 and parts[1].upper() not in ('ASC', 'DESC')):
+            raise Exception(f"Invalid orderBy term: '{term}'")
+        terms.append((parts[0], parts[1].upper() if len(parts) > 1
+                      else 'ASC'))
+    return terms
+
+
+class _Descending:
+    """ Wrap a value to compare it in reverse order. """
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __lt__(self, other):
+        return other.value < self.value
+
+    def __eq__(self, other):
+        return self.value == other.value
+
+
+def _rowSortKey(keys):
+    """ Return a function to sort rows (dicts) by the given (key, order)
+    pairs, as SQLite does, with NULL values as the smallest ones. """
+    def _key(row):
+        values = []
+        for k, order in keys:
+            v = row[k]
+            v = (v is not None, v)
+            values.append(v if order == 'ASC' else _Descending(v))
+        return values
+    return _key
+
+
+def _checkIdentifier(name):
+    """ Raise an exception if name is not a valid table or column name,
+    since these can not be passed as query parameters. """
+    if not _IDENTIFIER_RE.match(name):
+        raise Exception(f"Invalid table or column name: '{name}'")
+    return name
+
+
+def _mapNames(text, namesMap):
+    """ Replace names in a SQL condition, skipping string literals. """
+    if not namesMap:
+        return text
+
+    def _replace(m):
+        return namesMap.get(m.group(0), m.group(0))
+
+    return _NAMES_RE.sub(_replace, text)
+
+
+def _getMTime(fileName):
+    """ Return the modification time (in ns) of the db, also taking into
+    account the write-ahead log file if it exists. """
+    mTime = os.stat(fileName).st_mtime_ns
+    walFile = fileName + '-wal'
+    if os.path.exists(walFile):
+        mTime = max(mTime, os.stat(walFile).st_mtime_ns)
+    return mTime
+
+
+def _isBusy(e):
+    """ Return True if the exception is due to the database being
+    locked by other connection. """
+    if not isinstance(e, sqlite3.OperationalError):
+        return False
+    code = getattr(e, 'sqlite_errorcode', None)
+    if code is not None:
+        return code & 0xff in (sqlite3.SQLITE_BUSY, sqlite3.SQLITE_LOCKED)
+    return 'locked' in str(e) or 'busy' in str(e)
+
+
+def _retryBusy(func, tries=10, wait=0.1, maxWait=10):
+    """ Call func and try again if the database is busy, waiting
+    longer each time (up to maxWait seconds). """
+    while True:
+        try:
+            return func()
+        except sqlite3.OperationalError as e:
+            tries -= 1
+            if not _isBusy(e) or tries <= 0:
+                raise
+            time.sleep(wait)
+            wait = min(wait * 2, maxWait)
@@ -23,13 +23,18 @@ __author__ = 'Jose Miguel de la Rosa Trevin, Grigory Sharov'
 
 import os
 import sys
-import time
 import re
+import zlib
+import pickle
 from contextlib import AbstractContextManager
 from collections import OrderedDict
 from datetime import datetime, timedelta
 
-from .table import ColumnList, Table
+import numpy as np
+
+from emtools.utils import FileWatcher
+from .table import ColumnList, Table, _toArray
+from .seen import SeenKeys
 
 
 class StarFile(AbstractContextManager):
@@ -119,16 +124,61 @@ class StarFile(AbstractContextManager):
                     If False, all values will be returned as strings
                 types=None, optional types dict with {columnName: columnType}
                     pairs that allows to specify types for certain columns.
+                dtypes=None, optional dict with {columnName: dtype} pairs.
+                    If passed, the values of each column will be stored in
+                    numpy arrays, using the given dtype for these columns.
+                compact=False, if True, values will be stored in numpy
+                    arrays by column, using 32 bits types for numbers if
+                    precision allows (see Table.compact).
         """
         self.__createTable(tableName, **kwargs)
+        dtypes = kwargs.get('dtypes', None)
+        compact = kwargs.get('compact', False)
+
         if self._singleRow:
             self._table.addRow(self.__rowFromValues(self._values))
+            if dtypes or compact:
+                self._table.compact(dtypes=dtypes)
+        elif dtypes or compact:
+            self.__loadColumns(dtypes or {}, compact)
         else:
             for line in self._iterRowLines():
                 self._table.addRow(self.__rowFromValues(self.__split_line(line)))
 
         return self._table
 
+    def __loadColumns(self, dtypes, compact, chunkSize=100000):
+        """ Load the table values into numpy arrays by column.
+        Values are parsed in chunks to avoid keeping all of them
+        as Python objects at the same time. """
+        columns = list(self._table.getColumns())
+        chunks = [[] for _ in columns]
+        values = [[] for _ in columns]
+
+        def _addChunk():
+            for col, colValues, colChunks in zip(columns, values, chunks):
+                colChunks.append(_toArray(colValues, col.getType(),
+                                          dtype=dtypes.get(col.getName()),
+                                          compact=compact))
+                colValues.clear()
+
+        appends = [v.append for v in values]
+        for i, line in enumerate(self._iterRowLines()):
+            for append, t, v in zip(appends, self._types,
+                                    self.__split_line(line)):
+                append(t(v))
+            if (i + 1) % chunkSize == 0:
+                _addChunk()
+
+        if values[0] or not chunks[0]:
+            _addChunk()
+
+        table = Table.fromNumpy({col.getName(): np.concatenate(colChunks)
+                                 for col, colChunks in zip(columns, chunks)})
+        for col in columns:
+            table.getColumn(col.getName()).setType(col.getType())
+        self._table = table
+
     def getTableSize(self, tableName):
         """
         Return the number of elements in the given table without parsing
@@ -188,10 +238,7 @@ class StarFile(AbstractContextManager):
 
     def __split_line(self, line, default=[]):
         """ Split a data line taking into account string literals """
-        if '"' in line:
-            return self._splitRegex.findall(line) if line else default
-
-        return line.split() if line else default
+        return _splitLine(line) if line else default
 
     def _loadTableInfo(self, tableName):
         self._findDataLine(tableName)
@@ -206,9 +253,13 @@ class StarFile(AbstractContextManager):
             colNames.append(parts[0][1:])
             if not self._foundLoop:
                 values.append(parts[1])
+            self._dataOffset = self._file.tell()
             self._line = self._file.readline().strip()
 
         self._singleRow = not self._foundLoop
+        # Offset of the first data line, used to read only new rows
+        if self._singleRow:
+            self._dataOffset = None
 
         if self._foundLoop:
             values = self.__split_line(self._line)
@@ -360,6 +411,21 @@ class StarFile(AbstractContextManager):
         """
         self.writeRowValues(row._asdict().values())
 
+    def writeRows(self, rows):
+        """ Write many rows at once, faster than calling writeRow
+        for each of them. Rows can be Row instances or lists of values
+        in the order of the expected columns.
+        """
+        rows = rows if isinstance(rows, list) else list(rows)
+        if not rows:
+            return
+        if not self._format:
+            self._computeLineFormat(rows)
+
+        format = self._format.format
+        self._file.write(''.join(format(*[_escapeStrValue(v) for v in row])
+                                 for row in rows))
+
     def _writeNewline(self):
         self._file.write('\n')
 
@@ -410,9 +476,29 @@ class StarMonitor:
     This class will subclass OrderedDict to hold a clone of each new element.
     It will also keep internally the last access timestamp to prevent loading
     the STAR file if it has not been modified since the last check.
+
+    Only the lines appended after the last complete row are parsed on
+    each update. The file is scanned again from the beginning only if
+    it was rewritten (i.e. the header or the last read row changed).
+    A last row without newline is returned when it has all the columns
+    and the file size did not change since the previous update.
+
+    Keys of the rows already seen are stored in a SeenKeys instance
+    that can be passed with the 'seen' argument. For very large streams,
+    HashedSeenKeys (8 bytes per row) or SeenRowCount (only the number
+    of rows, for append-only files) can be used.
+
+    If a 'checkpoint' file is given, the state of the monitor is saved
+    there after reading new rows and restored when a new monitor is
+    created, so rows are not returned again after a restart.
     """
+    # Attributes saved in the checkpoint file
+    _CHECKPOINT_ATTRS = ['inputCount', '_seenItems', '_dataOffset',
+                         '_fingerprint', '_offset', '_lastLine', '_rowCount']
+
     def __init__(self, fileName, tableName, rowKeyFunc, **kwargs):
-        self._seenItems = set()
+        seen = kwargs.get('seen', None)
+        self._seenItems = SeenKeys() if seen is None else seen
         self.fileName = fileName
         self._tableName = tableName
         self._rowKeyFunc = rowKeyFunc
@@ -422,33 +508,160 @@ class StarMonitor:
         self.lastUpdate = None  # Last timestamp when new items were found
         self.inputCount = 0  # Count all input elements
 
+        # Info needed to only read new rows from the file
+        self._size = None
+        self._dataOffset = None  # Offset of the first data row
+        self._fingerprint = None  # crc32 of the content before data rows
+        self._offset = None  # Offset after the last complete row
+        self._lastLine = b''  # Last line read, to detect rewritten files
+        self._rowCount = 0  # Number of rows read until offset
+        self._tailSize = None  # File size when an unterminated row was found
+        self._Row = None
+        self._types = None
+
+        self._checkpoint = kwargs.get('checkpoint', None)
+        if self._checkpoint and os.path.exists(self._checkpoint):
+            self._loadCheckpoint()
+
         # Black list some items to not be monitored again
         # We are not interested in the items but just skip them from
         # the processing
         blacklist = kwargs.get('blacklist', None)
         if blacklist:
-            for row in blacklist:
-                self._seenItems.add(self._rowKeyFunc(row))
+            self._seenItems.update(self._getKeys(blacklist))
 
     def update(self):
         newRows = []
         now = datetime.now()
-        mTime = datetime.fromtimestamp(os.path.getmtime(self.fileName))
-
-        if self.lastCheck is None or mTime > self.lastCheck:
-            with StarFile(self.fileName) as sf:
-                for row in sf.iterTable(self._tableName):
-                    rowKey = self._rowKeyFunc(row)
-                    if rowKey not in self._seenItems:
-                        self.inputCount += 1
-                        self._seenItems.add(rowKey)
-                        newRows.append(row)
+        stat = os.stat(self.fileName)
+        mTime = datetime.fromtimestamp(stat.st_mtime)
+
+        if (self.lastCheck is None or mTime > self.lastCheck
+                or stat.st_size != self._size or self._tailSize is not None):
+            self._size = stat.st_size
+            rows = self._readRows()
+            if rows:
+                start = self._rowCount - len(rows)  # Index of first row
+                mask = self._seenItems.filterNew(self._getKeys(rows), start)
+                newRows = [row for row, new in zip(rows, mask) if new]
+                self.inputCount += len(newRows)
+            if self._checkpoint:
+                self._saveCheckpoint()
 
         self.lastCheck = now
         if newRows:
             self.lastUpdate = now
         return newRows
 
+    def _getKeys(self, rows):
+        if self._rowKeyFunc is None:
+            return rows
+        return [self._rowKeyFunc(row) for row in rows]
+
+    def _loadTableInfo(self):
+        """ Read the table header and the offset where data rows start. """
+        with StarFile(self.fileName) as sf:
+            table = sf.getTableInfo(self._tableName)
+            self._dataOffset = sf._dataOffset
+        self._Row = table.Row
+        self._types = [c.getType() for c in table.getColumns()]
+
+    def _checkFile(self, f):
+        """ Return True if the content already read has not changed. """
+        if self._offset is None or self._size < self._offset:
+            return False
+        f.seek(0)
+        if zlib.crc32(f.read(self._dataOffset)) != self._fingerprint:
+            return False
+        n = len(self._lastLine)
+        f.seek(self._offset - n)
+        return f.read(n) == self._lastLine
+
+    def _readRows(self):
+        """ Parse the rows appended since the last read. """
+        with open(self.fileName, 'rb') as f:
+            if self._checkFile(f):
+                if self._Row is None:  # Restored from checkpoint
+                    self._loadTableInfo()
+            else:
+                self._loadTableInfo()
+                self._rowCount = 0
+                if self._dataOffset is None:  # Single row table
+                    with StarFile(self.fileName) as sf:
+                        rows = list(sf.iterTable(self._tableName))
+                    self._rowCount = len(rows)
+                    return rows
+                f.seek(0)
+                self._fingerprint = zlib.crc32(f.read(self._dataOffset))
+                self._offset = self._dataOffset
+                self._lastLine = b''
+                self._tailSize = None
+
+            f.seek(self._offset)
+            data = f.read()
+
+        rows = []
+
+        def _addRow(line):
+            values = _splitLine(line)
+            rows.append(self._Row(*[t(v) for t, v in zip(self._types,
+                                                         values)]))
+
+        lines = data.split(b'\n')
+        # Last element is an incomplete line or empty
+        tail = lines.pop()
+        for rawLine in lines:
+            line = rawLine.decode().strip()
+            if line.startswith('data_'):  # Next table started
+                tail = b''
+                break
+            self._lastLine = rawLine + b'\n'
+            self._offset += len(self._lastLine)
+            if line and not line.startswith('#'):
+                _addRow(line)
+
+        # The last line might be a complete row without newline, wait
+        # until the file is not modified in the next update to use it
+        line = tail.decode(errors='ignore').strip()
+        if (line and not line.startswith(('#', 'data_'))
+                and len(_splitLine(line)) == len(self._types)):
+            if self._tailSize == self._size:
+                _addRow(line)
+                self._lastLine = tail
+                self._offset += len(tail)
+                self._tailSize = None
+            else:
+                self._tailSize = self._size
+        else:
+            self._tailSize = None
+
+        self._rowCount += len(rows)
+        return rows
+
+    def _saveCheckpoint(self):
+        """ Write the monitor state to the checkpoint file. A temporary
+        file is written first and then renamed, so the checkpoint is
+        never left incomplete. """
+        state = {a: getattr(self, a) for a in self._CHECKPOINT_ATTRS}
+        state['fileName'] = os.path.abspath(self.fileName)
+        state['tableName'] = self._tableName
+        tmpFile = self._checkpoint + '.tmp'
+        with open(tmpFile, 'wb') as f:
+            pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmpFile, self._checkpoint)
+
+    def _loadCheckpoint(self):
+        with open(self._checkpoint, 'rb') as f:
+            state = pickle.load(f)
+        source = (os.path.abspath(self.fileName), self._tableName)
+        if (state['fileName'], state['tableName']) != source:
+            raise Exception(f"Checkpoint '{self._checkpoint}' is for table "
+                            f"'{state['tableName']}' of '{state['fileName']}'")
+        for a in self._CHECKPOINT_ATTRS:
+            setattr(self, a, state[a])
+
     def timedOut(self):
         """ Return True when there has been timeout seconds
         since last new items were found. """
@@ -458,14 +671,26 @@ class StarMonitor:
             return self.lastCheck - self.lastUpdate > self._timeout
 
     def newItems(self, sleep=10):
-        """ Yield new items since last update until the stream is closed. """
-        while not self.timedOut():
-            for row in self.update():
-                yield row
-            time.sleep(self._wait)
+        """ Yield new items since last update until the stream is closed.
+        Between updates, it will wait until the file is modified or
+        at most 'wait' seconds.
+        """
+        with FileWatcher(self.fileName) as watcher:
+            while not self.timedOut():
+                for row in self.update():
+                    yield row
+                watcher.wait(timeout=self._wait)
 
 
 # --------- Helper functions  ------------------------
+def _splitLine(line):
+    """ Split a data line taking into account string literals """
+    if '"' in line:
+        return StarFile._splitRegex.findall(line)
+
+    return line.split()
+
+
 def _formatValue(v):
     return '%0.6f' % v if isinstance(v, float) else str(v)
 
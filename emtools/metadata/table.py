@@ -22,7 +22,13 @@
 __author__ = 'Jose Miguel de la Rosa Trevin, Grigory Sharov'
 
 
+import sys
 from collections import OrderedDict, namedtuple
+from itertools import repeat
+
+import numpy as np
+
+from .expression import Expression
 
 
 class Column:
@@ -89,27 +95,11 @@ class ColumnList:
         return [c.getName() for c in self.getColumns()]
 
     def createRowClass(self):
-
-        class Row(namedtuple('_Row', self._columns.keys())):
-            __slots__ = ()
-
-            def hasColumn(self, colName):
-                """ Return True if the row has this column. """
-                return hasattr(self, colName)
-
-            def hasAnyColumn(self, colNames):
-                return any(self.hasColumn(c) for c in colNames)
-
-            def hasAllColumns(self, colNames):
-                return all(self.hasColumn(c) for c in colNames)
-
-            def set(self, key, value):
-                return setattr(self, key, value)
-
-            def get(self, key, default=None):
-                return getattr(self, key, default)
-
-        return Row
+        """ Return the Row class for the current columns.
+        Row classes are cached and shared by all tables with the
+        same column names.
+        """
+        return _getRowClass(tuple(self._columns.keys()))
 
     @staticmethod
     def createColumns(colNames, values, guessType=True, types=None):
@@ -137,32 +127,501 @@ class ColumnList:
 class Table(ColumnList):
     """
     Class to hold and manipulate tabular data.
+
+    Functions like filter, select or slicing return views of the table.
+    A view shares the rows with the original table, storing only the
+    indexes of its rows (and of its columns when a subset is selected).
+    The view rows are only copied when the view is modified.
+
+    Rows are usually stored as a list of Row instances, but a table can
+    also store the values of each column in numpy arrays (e.g. created
+    with Table.fromNumpy). In that case, rows are created when iterating
+    and the arrays are converted to a list of rows only if the table
+    is modified.
     """
     def __init__(self, columns=None):
         ColumnList.__init__(self, columns)
         self.Row = self.createRowClass()
         self._rows = []
+        self._data = None  # Columns arrays, if used instead of self._rows
+        self._arrays = {}  # Cache of column values as numpy arrays
+        # Used by views, rows positions and columns positions in self._rows
+        self._index = None
+        self._colsIndex = None
+        self._shared = False  # True if some view is using self._rows
+        # Hash indexes: {columnName: {value: row or list of rows}}
+        self._indexes = {}
+        self._uniqueIndexes = set()
+
+    def _clearCache(self):
+        """ Clear cached data computed from the rows.
+        Should be called every time the rows are modified. """
+        self._arrays.clear()
+
+    def isView(self):
+        """ Return True if the rows are accessed through an index, i.e
+        the table shares its rows with another one or it has been sorted
+        and the new order has not been applied yet. """
+        return self._index is not None or self._colsIndex is not None
+
+    def isColumnar(self):
+        """ Return True if values are stored in numpy arrays by column. """
+        return self._data is not None
+
+    def _materialize(self):
+        """ Create its own list of rows if this table is a view or
+        the values are stored in columns arrays.
+        Should be called before any modification of the rows. """
+        if self.isView() or self.isColumnar():
+            recreated = self._colsIndex is not None or self.isColumnar()
+            self._rows = list(self._iterRows())
+            self._data = None
+            self._index = None
+            self._colsIndex = None
+            self._shared = False
+            self._clearCache()
+            if recreated:
+                self._rebuildIndexes()
+
+    def _setData(self, data):
+        """ Use the given arrays as storage for the columns values. """
+        self._data = {k: _readOnly(v) for k, v in data.items()}
+        self._rows = None
+        self._index = None
+        self._colsIndex = None
+        self._shared = False
+        self._clearCache()
+        self._rebuildIndexes()
+
+    def _ownRows(self):
+        """ Make sure the rows list is not shared with any view.
+        Should be called before modifying the rows list in place
+        (i.e. changing or appending rows). """
+        self._materialize()
+        if self._shared:
+            self._rows = list(self._rows)
+            self._shared = False
+
+    def _iterSourceRows(self):
+        """ Iterate over the rows as stored, without columns selection. """
+        if self._index is None:
+            return iter(self._rows)
+        rows = self._rows
+        return (rows[i] for i in self._index.tolist())
+
+    def _iterRows(self):
+        if self.isColumnar():
+            return self._iterDataRows()
+        if self._colsIndex is None:
+            return self._iterSourceRows()
+        return map(self._selectRow, self._iterSourceRows())
+
+    def _iterDataRows(self, chunkSize=10000):
+        """ Iterate over rows created from the columns arrays.
+        Values are converted in chunks to limit the memory used. """
+        arrays = [self._data[c] for c in self._columns]
+        for start in range(0, self.size(), chunkSize):
+            end = start + chunkSize
+            if self._index is None:
+                chunk = slice(start, end)
+            else:
+                chunk = self._index[start:end]
+            values = [a[chunk].tolist() for a in arrays]
+            yield from map(self.Row._make, zip(*values))
+
+    def _selectRow(self, row):
+        return self.Row._make([row[i] for i in self._colsIndex])
+
+    def _getRow(self, i):
+        if self.isColumnar():
+            i = range(self.size())[i]
+            j = i if self._index is None else self._index[i]
+            return self.Row._make([self._data[c].item(j)
+                                   for c in self._columns])
+        row = self._rows[i if self._index is None else self._index[i]]
+        return row if self._colsIndex is None else self._selectRow(row)
+
+    def _createView(self, index=None, columns=None):
+        """ Create a new Table sharing the rows with this one.
+
+        Args:
+            index: positions of the rows (relative to this table) in the view.
+            columns: names of the columns in the view.
+        """
+        columns = columns or self.getColumnNames()
+        view = Table([Column(c, self.getColumn(c).getType()) for c in columns])
+        view._rows = self._rows
+
+        if index is None:
+            view._index = self._index
+        else:
+            view._index = index if self._index is None else self._index[index]
+
+        if self.isColumnar():
+            # Arrays are read-only so they can be shared safely
+            view._data = self._data
+            if view._index is None:
+                view._index = np.arange(self.size())
+            return view
+
+        if self._colsIndex is None:
+            srcIndex = {c: i for i, c in enumerate(self.getColumnNames())}
+        else:
+            srcIndex = {c: i for c, i in zip(self.getColumnNames(),
+                                             self._colsIndex)}
+        if self._colsIndex is not None or columns != self.getColumnNames():
+            view._colsIndex = tuple(srcIndex[c] for c in columns)
+
+        if view._index is None and view._colsIndex is None:
+            view._index = np.arange(len(self._rows))
+
+        self._shared = view._shared = True
+        return view
 
     def clear(self):
         self.Row = None
         self._columns.clear()
         self._rows = []
+        self._data = None
+        self._index = None
+        self._colsIndex = None
+        self._shared = False
+        self._indexes.clear()
+        self._uniqueIndexes.clear()
+        self._clearCache()
 
     def clearRows(self):
         """ Remove all the rows from the table, but keep its columns. """
         self._rows = []
+        self._data = None
+        self._index = None
+        self._colsIndex = None
+        self._shared = False
+        self._clearCache()
+        self._rebuildIndexes()
 
     def addRow(self, row):
         """ Add a new Row. """
+        self._ownRows()
+        self._indexRow(row)
         self._rows.append(row)
+        self._clearCache()
 
     def addRowValues(self, *args, **kwargs):
         """ Append a new Row from the given values. """
+        self._ownRows()
         row = self.Row(*args, **kwargs)
+        self._indexRow(row)
         self._rows.append(row)
+        self._clearCache()
         return row
 
+    def extend(self, rows):
+        """ Append many rows at once.
+
+        Args:
+            rows: another Table containing (at least) the same columns,
+                or an iterable of rows. Each row can be a Row, a tuple or
+                list with the values in the columns order, or a dict.
+        """
+        if isinstance(rows, Table):
+            colNames = self.getColumnNames()
+            if rows.getColumnNames() == colNames:
+                newRows = list(rows._iterRows())
+            else:
+                for c in colNames:
+                    if not rows.hasColumn(c):
+                        raise Exception("Missing column '%s' in the table "
+                                        "to extend from." % c)
+                newRows = self._rowsFromColumns(
+                    [rows.getColumnValues(c) for c in colNames])
+        else:
+            newRows = [r if type(r) is self.Row else self._rowFromRecord(r)
+                       for r in rows]
+
+        self._ownRows()
+        self._indexRows(newRows)
+        self._rows.extend(newRows)
+        self._clearCache()
+
+    @staticmethod
+    def concat(tables, fill=None):
+        """ Create a new Table with the rows of all the given tables.
+
+        Columns are matched by name and the result will contain all
+        columns found in any of the tables, in order of appearance.
+        If types differ for a column, int will be promoted to float and
+        any other mismatch will be promoted to string type (converting
+        all values of the column to strings).
+
+        Args:
+            tables: list of tables to concatenate.
+            fill: value used for columns missing in some tables. If None,
+                all tables are required to have the same columns.
+        """
+        columns = OrderedDict()
+        promoted = set()  # Columns with mixed types promoted to strings
+        for t in tables:
+            for col in t.getColumns():
+                colName, colType = col.getName(), col.getType()
+                if colName not in columns:
+                    columns[colName] = colType
+                elif columns[colName] != colType:
+                    types = {columns[colName], colType}
+                    if types == {int, float}:
+                        columns[colName] = float
+                    else:
+                        columns[colName] = _str
+                        promoted.add(colName)
+
+        data = []
+        for colName, colType in columns.items():
+            values = []
+            for t in tables:
+                if t.hasColumn(colName):
+                    tValues = t.getColumnValues(colName)
+                    if colType is float and t.getColumn(colName).getType() is int:
+                        tValues = list(map(float, tValues))
+                    elif colName in promoted:
+                        tValues = list(map(str, tValues))
+                    values.extend(tValues)
+                elif fill is None:
+                    raise Exception("Missing column '%s' in some tables, "
+                                    "use 'fill' value to concatenate them."
+                                    % colName)
+                else:
+                    values.extend(repeat(str(fill) if colName in promoted
+                                         else fill, t.size()))
+            data.append(values)
+
+        table = Table([Column(k, v) for k, v in columns.items()])
+        table._rows = table._rowsFromColumns(data)
+        return table
+
+    @staticmethod
+    def fromArrays(arrays):
+        """ Create a new Table from the values of each column.
+
+        Args:
+            arrays: dict with {columnName: values} pairs, values can be
+                lists or numpy arrays, all of the same length.
+        """
+        sizes = {len(values) for values in arrays.values()}
+        if len(sizes) > 1:
+            raise Exception("All columns should have the same number "
+                            "of values, found sizes: %s" % sizes)
+        columns = []
+        data = []
+        for colName, values in arrays.items():
+            if isinstance(values, np.ndarray):
+                colType = _typeFromDtype(values.dtype)
+                values = values.tolist()
+            else:
+                colType = _typeFromValue(values[0]) if len(values) else _str
+            columns.append(Column(colName, colType))
+            data.append(values)
+
+        table = Table(columns)
+        table._rows = table._rowsFromColumns(data)
+        return table
+
+    @staticmethod
+    def fromRecords(records, columns=None):
+        """ Create a new Table from an iterable of records.
+
+        Args:
+            records: iterable of dicts, namedtuples or tuples.
+            columns: list of columns (or names) of the new table. If None,
+                columns are taken from the first record (dict keys or
+                namedtuple fields) and types guessed from its values.
+        """
+        records = iter(records)
+        first = next(records, None)
+
+        if columns is None:
+            if first is None:
+                raise Exception("Columns should be provided if there "
+                                "are no records.")
+            if isinstance(first, dict):
+                names, values = list(first.keys()), list(first.values())
+            elif hasattr(first, '_fields'):
+                names, values = list(first._fields), list(first)
+            else:
+                raise Exception("Columns should be provided for records "
+                                "that are not dicts or namedtuples.")
+            columns = [Column(n, _typeFromValue(v))
+                       for n, v in zip(names, values)]
+
+        table = Table(columns)
+        if first is not None:
+            table._rows.append(table._rowFromRecord(first))
+            table._rows.extend(map(table._rowFromRecord, records))
+        return table
+
+    def toNumpy(self, columns=None, structured=False):
+        """ Return the values of the table as numpy arrays.
+
+        Arrays are the same returned by getColumnArray, so they are
+        cached and, if the table stores its values by columns, no data
+        is copied. Arrays are read-only.
+
+        Args:
+            columns: list of columns names, if None, all columns are used.
+            structured: if True, return a single structured array (with
+                one field per column) instead of a dict. This requires
+                copying the values.
+
+        Return:
+            A dict with {columnName: array} or a numpy structured array.
+        """
+        columns = columns or self.getColumnNames()
+        arrays = {c: self.getColumnArray(c) for c in columns}
+
+        if not structured:
+            return arrays
+
+        result = np.empty(self.size(), dtype=[(c, a.dtype)
+                                              for c, a in arrays.items()])
+        for c, a in arrays.items():
+            result[c] = a
+        return result
+
+    @staticmethod
+    def fromNumpy(data):
+        """ Create a new Table that uses the given arrays to store the
+        values of each column, without copying them. The table will
+        only create a list of rows if it is modified.
+
+        Args:
+            data: dict with {columnName: array} or a structured array.
+        """
+        if isinstance(data, np.ndarray):
+            if data.dtype.names is None:
+                raise Exception("Only structured arrays can be converted "
+                                "to a Table, use a dict of arrays instead.")
+            data = {name: data[name] for name in data.dtype.names}
+
+        arrays = {k: np.asarray(v) for k, v in data.items()}
+        if any(a.ndim != 1 for a in arrays.values()):
+            raise Exception("Only 1D arrays are supported as columns.")
+        sizes = {len(a) for a in arrays.values()}
+        if len(sizes) > 1:
+            raise Exception("All columns should have the same number "
+                            "of values, found sizes: %s" % sizes)
+
+        table = Table([Column(k, _typeFromDtype(a.dtype))
+                       for k, a in arrays.items()])
+        table._setData(arrays)
+        return table
+
+    def compact(self, dtypes=None):
+        """ Store the values of each column in numpy arrays using less
+        memory when possible. Integer columns will use int32 if values
+        are in range and float columns float32 if values do not change
+        when rounded to 6 decimals (as written in STAR files). Strings
+        are stored in object arrays, sharing repeated values.
+
+        Args:
+            dtypes: optional dict with {columnName: dtype} for
+                some columns, e.g {'rlnAngleRot': 'float32'}
+        """
+        dtypes = dtypes or {}
+        data = {}
+        for col in self.getColumns():
+            colName = col.getName()
+            data[colName] = _toArray(self.getColumnValues(colName),
+                                     col.getType(), dtype=dtypes.get(colName),
+                                     compact=True)
+        self._setData(data)
+
+    def memoryUsage(self, deep=True):
+        """ Return the memory (in bytes) used to store the table values.
+
+        Memory of shared storage (e.g. for views) is also counted.
+
+        Args:
+            deep: if True, also count the memory of the Python objects
+                (numbers, strings) referenced from the rows or the
+                object arrays. Objects shared are counted only once.
+
+        Return:
+            A dict with the memory of each column ('columns'), of the Row
+            objects and list ('rows'), of the rows index used by views or
+            sorting ('index'), of the cached arrays ('cache') and 'total'.
+        """
+        ptrSize = np.dtype(object).itemsize
+        seen = set()
+
+        def _objectsSize(values):
+            size = 0
+            for v in values:
+                if id(v) not in seen:
+                    seen.add(id(v))
+                    size += sys.getsizeof(v)
+            return size
+
+        columns = OrderedDict()
+        rowsSize = 0
+        cacheSize = 0
+        n = self.size()
+
+        if self.isColumnar():
+            for colName in self._columns:
+                values = self._data[colName]
+                columns[colName] = values.nbytes
+                if deep and values.dtype == object:
+                    columns[colName] += _objectsSize(values.tolist())
+            for colName, values in self._arrays.items():
+                if not np.shares_memory(values, self._data[colName]):
+                    cacheSize += values.nbytes
+        else:
+            for colName in self._columns:
+                columns[colName] = n * ptrSize
+                if deep:
+                    columns[colName] += _objectsSize(
+                        self.getColumnValues(colName))
+            rowsSize = sys.getsizeof(self._rows) + n * sys.getsizeof(())
+            cacheSize = sum(values.nbytes for values in self._arrays.values())
+
+        indexSize = 0 if self._index is None else self._index.nbytes
+
+        return {
+            'columns': columns,
+            'rows': rowsSize,
+            'index': indexSize,
+            'cache': cacheSize,
+            'total': sum(columns.values()) + rowsSize + indexSize + cacheSize
+        }
+
+    def toPandas(self, columns=None):
+        """ Return a pandas.DataFrame with the values of the table.
+        Column arrays are passed to pandas without copying, but pandas
+        might copy them depending on the types of the columns.
+        """
+        import pandas as pd
+        return pd.DataFrame(self.toNumpy(columns), copy=False)
+
+    @staticmethod
+    def fromPandas(df):
+        """ Create a new Table from a pandas.DataFrame. Columns values
+        are not copied if pandas can provide them as numpy arrays. """
+        return Table.fromNumpy({str(c): df[c].to_numpy(copy=False)
+                                for c in df.columns})
+
+    def _rowsFromColumns(self, columns):
+        """ Create rows from the list of values of each column. """
+        return list(map(self.Row._make, zip(*columns)))
+
+    def _rowFromRecord(self, record):
+        if isinstance(record, dict):
+            return self.Row._make([record[c] for c in self._columns])
+        return self.Row._make(record)
+
     def size(self):
+        if self._index is not None:
+            return len(self._index)
+        if self.isColumnar():
+            return len(next(iter(self._data.values()), []))
         return len(self._rows)
 
     def addColumns(self, *args):
@@ -170,51 +629,102 @@ class Table(ColumnList):
 
         Each argument should be in the form:
             columnName=value
-        where value can be a constant or another column.
+        where value can be a constant, another column or an expression
+        using other columns (see :class:`Expression`). Expressions are
+        evaluated with numpy over the whole column values. If columnName
+        already exists, its values will be replaced.
 
         Examples:
             table.addColumns('rlnDefocusU=rlnDefocusV', 'rlnDefocusAngle=0.0')
+            table.addColumns('rlnCtfAstigmatism=abs(rlnDefocusU-rlnDefocusV)')
+            table.addColumns('rlnCoordinateX=rlnCoordinateX * 2')
         """
-        # TODO:
-        # Maybe implement more complex value expression,
-        # e.g some basic arithmetic operations or functions
-
-        map = {k: k for k in self.getColumnNames()}
-        constSet = set()
+        if not self.isColumnar():
+            self._materialize()
+        n = self.size()
         newCols = OrderedDict()
+        newValues = {}  # numpy arrays or constants for new columns
+        copies = {}  # new columns that are a copy of existing ones
+
+        def _getArray(colName):
+            if colName in copies:
+                return self.getColumnArray(copies[colName])
+            if colName in newValues:
+                return np.asarray(newValues[colName])
+            return self.getColumnArray(colName)
 
         for a in args:
-            colName, right = a.split('=')
-            if self.hasColumn(right):
-                colType = self.getColumn(right).getType()
-                map[colName] = right
-            elif right in newCols:
+            colName, right = [p.strip() for p in a.split('=', 1)]
+            copy = value = None
+            if right in newCols:
                 colType = newCols[right].getType()
-                map[colName] = map[right]
+                copy, value = copies.get(right), newValues.get(right)
+            elif self.hasColumn(right):
+                colType = self.getColumn(right).getType()
+                copy = right
+            elif expr := self._parseExpression(right, newCols):
+                values = np.broadcast_to(expr.evaluate(_getArray), (n,))
+                colType = _typeFromDtype(values.dtype)
+                value = values.astype(int if colType is int else values.dtype)
             else:
                 colType = _guessType(right)
                 value = colType(right)
-                map[colName] = value
-                constSet.add(value)
 
+            copies.pop(colName, None)
+            newValues.pop(colName, None)
+            if copy is None:
+                newValues[colName] = value
+            else:
+                copies[colName] = copy
             newCols[colName] = Column(colName, colType)
 
         # Update columns and create new Row class
+        oldColumns = list(self._columns)
         self._columns.update(newCols)
         self.Row = self.createRowClass()
 
-        # Update rows with new column values
-        oldRows = self._rows
-        self.clearRows()
+        if self.isColumnar():
+            data = {}
+            for colName in self.getColumnNames():
+                if colName in newValues:
+                    values = newValues[colName]
+                    data[colName] = (values if isinstance(values, np.ndarray)
+                                     else np.full(n, values))
+                else:
+                    data[colName] = self.getColumnArray(copies.get(colName,
+                                                                   colName))
+            self._setData(data)
+            return
+
+        # Rebuild rows from the values of each column
+        columns = []
+        for colName in self.getColumnNames():
+            if colName in newValues:
+                values = newValues[colName]
+                columns.append(values.tolist()
+                               if isinstance(values, np.ndarray)
+                               else repeat(values, n))
+            else:
+                i = oldColumns.index(copies.get(colName, colName))
+                columns.append([row[i] for row in self._rows])
 
-        def _get(row, colName):
-            # Constants are passed as tuple
-            mapped = map[colName]
-            return mapped if mapped in constSet else getattr(row, mapped)
+        self._rows = self._rowsFromColumns(columns)
+        self._clearCache()
+        self._rebuildIndexes()
 
-        colNames = self.getColumnNames()
-        for row in oldRows:
-            self._rows.append(self.Row(**{k: _get(row, k) for k in colNames}))
+    def _parseExpression(self, text, newCols=()):
+        """ Return an Expression from the text if it references any
+        existing column, or None otherwise (e.g a string constant).
+        """
+        try:
+            names = Expression.getNames(text)
+        except SyntaxError:
+            return None
+
+        if any(self.hasColumn(n) or n in newCols for n in names):
+            return Expression(text)
+
+        return None
 
     def removeColumns(self, *args):
         """ Remove columns with these names. """
@@ -226,6 +736,16 @@ class Table(ColumnList):
             else:
                 rmCols.append(a)
 
+        if self.isColumnar():
+            keep = [c for c in self.getColumnNames() if c not in rmCols]
+            data = {c: self.getColumnArray(c) for c in keep}
+            self._columns = OrderedDict([(c, self._columns[c]) for c in keep])
+            self.Row = self.createRowClass()
+            self._dropIndexes(rmCols)
+            self._setData(data)
+            return
+
+        self._materialize()
         oldColumns = self._columns
         oldRows = self._rows
 
@@ -241,6 +761,14 @@ class Table(ColumnList):
         for row in oldRows:
             self._rows.append(self.Row(**{k: getattr(row, k) for k in cols}))
 
+        self._dropIndexes(rmCols)
+        self._rebuildIndexes()
+
+    def _dropIndexes(self, colNames):
+        for colName in colNames:
+            self._indexes.pop(colName, None)
+            self._uniqueIndexes.discard(colName)
+
     def getColumnValues(self, colName):
         """
         Return the values of a given column
@@ -253,33 +781,418 @@ class Table(ColumnList):
         """
         if colName not in self._columns:
             raise Exception("Not existing column: %s" % colName)
-        return [getattr(row, colName) for row in self._rows]
+        if self.isColumnar():
+            return self.getColumnArray(colName).tolist()
+        return [getattr(row, colName) for row in self._iterSourceRows()]
+
+    def getColumnArray(self, colName):
+        """
+        Return the values of a given column as a numpy array.
 
-    def sort(self, key, reverse=False):
-        """ Sort the table in place using the provided key.
-        If key is a string, it should be the name of one column. """
-        def keyFunc(r):
-            return getattr(r, key) if isinstance(key, str) else key
-        self._rows.sort(key=keyFunc, reverse=reverse)
+        The array is cached until the table is modified, so it is
+        cheap to call this function many times. The returned array
+        is read-only.
+
+        Args:
+            colName: The name of an existing column to retrieve values.
+        """
+        if colName not in self._arrays:
+            col = self.getColumn(colName)
+            if col is None:
+                raise Exception("Not existing column: %s" % colName)
+            if self.isColumnar():
+                values = self._data[colName]
+                if self._index is not None:
+                    values = values[self._index]
+            else:
+                values = _columnArray(self.getColumnValues(colName),
+                                      col.getType())
+            self._arrays[colName] = _readOnly(values)
+
+        return self._arrays[colName]
+
+    def evaluate(self, expression):
+        """
+        Evaluate an expression over the values of the table columns.
+
+        Args:
+            expression: string or :class:`Expression` instance,
+                e.g 'abs(rlnDefocusU - rlnDefocusV) > 1000'
+
+        Return:
+            A numpy array with one value for each row of the table.
+        """
+        if isinstance(expression, str):
+            expression = Expression(expression)
+
+        values = expression.evaluate(self.getColumnArray)
+        return np.broadcast_to(values, (self.size(),))
+
+    def createIndex(self, colName, unique=False):
+        """
+        Create a hash index for the values of a given column.
+
+        The index will be updated when rows are added, replaced or
+        sorted and it allows fast queries with lookup and contains.
+
+        Args:
+            colName: The name of an existing column.
+            unique: If True, an exception will be raised when adding
+                a row with an existing value in that column.
+        """
+        if not self.hasColumn(colName):
+            raise Exception("Not existing column: %s" % colName)
+
+        self._indexes[colName] = self._buildIndex(colName, unique)
+        if unique:
+            self._uniqueIndexes.add(colName)
+        else:
+            self._uniqueIndexes.discard(colName)
+
+    def hasIndex(self, colName):
+        """ Return True if there is an index for this column. """
+        return colName in self._indexes
+
+    def lookup(self, colName, key, default=None):
+        """
+        Find rows with the given value in an indexed column.
+
+        Return:
+            The row with that value (or default if not found) if the
+            index is unique, or a list of rows otherwise.
+        """
+        index = self._getIndex(colName)
+        if colName in self._uniqueIndexes:
+            return index.get(key, default)
+        return list(index.get(key, []))
+
+    def contains(self, colName, key):
+        """ Return True if some row has this value in an indexed column. """
+        return key in self._getIndex(colName)
+
+    def _getIndex(self, colName):
+        if colName not in self._indexes:
+            raise Exception("There is no index for column: %s" % colName)
+        return self._indexes[colName]
+
+    def _buildIndex(self, colName, unique):
+        index = {}
+        if unique:
+            for row in self._iterRows():
+                key = getattr(row, colName)
+                if key in index:
+                    raise Exception("Duplicated value '%s' for unique index "
+                                    "of column: %s" % (key, colName))
+                index[key] = row
+        else:
+            for row in self._iterRows():
+                index.setdefault(getattr(row, colName), []).append(row)
+        return index
+
+    def _rebuildIndexes(self):
+        for colName in self._indexes:
+            self._indexes[colName] = self._buildIndex(
+                colName, colName in self._uniqueIndexes)
+
+    def _indexRow(self, row):
+        """ Add the row to existing indexes. Check first that unique
+        indexes will not have duplicated values. """
+        for colName in self._uniqueIndexes:
+            key = getattr(row, colName)
+            if key in self._indexes[colName]:
+                raise Exception("Duplicated value '%s' for unique index "
+                                "of column: %s" % (key, colName))
+
+        for colName, index in self._indexes.items():
+            key = getattr(row, colName)
+            if colName in self._uniqueIndexes:
+                index[key] = row
+            else:
+                index.setdefault(key, []).append(row)
+
+    def _indexRows(self, rows):
+        """ Add many rows to existing indexes. Nothing is added if
+        some unique index would have duplicated values. """
+        for colName in self._uniqueIndexes:
+            index = self._indexes[colName]
+            keys = set()
+            for row in rows:
+                key = getattr(row, colName)
+                if key in index or key in keys:
+                    raise Exception("Duplicated value '%s' for unique index "
+                                    "of column: %s" % (key, colName))
+                keys.add(key)
+
+        for colName, index in self._indexes.items():
+            if colName in self._uniqueIndexes:
+                index.update((getattr(row, colName), row) for row in rows)
+            else:
+                for row in rows:
+                    index.setdefault(getattr(row, colName), []).append(row)
+
+    def _unindexRow(self, row):
+        """ Remove the row from existing indexes. """
+        for colName, index in self._indexes.items():
+            key = getattr(row, colName)
+            if colName in self._uniqueIndexes:
+                index.pop(key, None)
+            else:
+                rows = index[key]
+                rows.remove(row)
+                if not rows:
+                    del index[key]
+
+    def filter(self, predicate):
+        """
+        Return a view of the table with only the rows matching a condition.
+
+        Args:
+            predicate: it can be an expression string (or :class:`Expression`)
+                evaluated over the columns, e.g 'rlnCtfMaxResolution < 4',
+                a function that receives a row and returns True or False,
+                or an array of booleans with one value per row.
+
+        Return:
+            A new Table sharing the rows with this one.
+        """
+        if isinstance(predicate, (str, Expression)):
+            mask = self.evaluate(predicate)
+        elif callable(predicate):
+            mask = np.fromiter(map(predicate, self._iterRows()), dtype=bool,
+                               count=self.size())
+        else:
+            mask = np.asarray(predicate)
+
+        if mask.dtype != bool or mask.shape != (self.size(),):
+            raise Exception("Filter condition should result in one "
+                            "boolean value per row.")
+
+        return self._createView(index=np.flatnonzero(mask))
+
+    def select(self, *columns):
+        """
+        Return a view of the table with only some of the columns.
+
+        Args:
+            columns: the names of the columns, either as many arguments
+                or a single list.
+
+        Return:
+            A new Table sharing the rows with this one.
+        """
+        if len(columns) == 1 and not isinstance(columns[0], str):
+            columns = columns[0]
+        for c in columns:
+            if not self.hasColumn(c):
+                raise Exception("Not existing column: %s" % c)
+        return self._createView(columns=list(columns))
+
+    def sort(self, key=None, reverse=False, keys=None):
+        """ Sort the table in place.
+
+        The new order is computed with a stable numpy.lexsort over the
+        columns values and it is only applied to the rows when the table
+        is modified, so sorting does not copy any row.
+
+        Args:
+            key: the name of one column or a function that receives
+                a row and returns the value to compare.
+            reverse: if True, the order will be descending. Only used
+                together with key.
+            keys: list of (columnName, order) pairs for sorting by many
+                columns, order should be 'asc' or 'desc'. e.g:
+                keys=[('rlnMicrographName', 'asc'),
+                      ('rlnAutopickFigureOfMerit', 'desc')]
+
+        Return:
+            The permutation (numpy array) applied to the previous order.
+        """
+        n = self.size()
+
+        if keys is None and isinstance(key, str):
+            keys = [(key, 'desc' if reverse else 'asc')]
+
+        if keys is not None:
+            sortKeys = []
+            # Last key passed to lexsort is the primary one
+            for k in reversed(keys):
+                colName, order = (k, 'asc') if isinstance(k, str) else k
+                values = self.getColumnArray(colName)
+                if order == 'desc':
+                    values = -np.unique(values, return_inverse=True)[1]
+                elif order != 'asc':
+                    raise Exception("Invalid sort order '%s', it should be "
+                                    "'asc' or 'desc'" % order)
+                sortKeys.append(values)
+            perm = np.lexsort(sortKeys) if sortKeys else np.arange(n)
+        elif callable(key):
+            values = [key(row) for row in self._iterRows()]
+            perm = np.array(sorted(range(n), key=values.__getitem__,
+                                   reverse=reverse), dtype=int)
+        else:
+            raise Exception("Invalid sort key %s, it should be a column "
+                            "name or a function." % key)
+
+        self._index = perm if self._index is None else self._index[perm]
+        # Cached columns values just need to be reordered
+        for colName, values in list(self._arrays.items()):
+            values = values[perm]
+            values.flags.writeable = False
+            self._arrays[colName] = values
+
+        # Keep the new order in the rows lists of non-unique indexes
+        for colName in self._indexes:
+            if colName not in self._uniqueIndexes:
+                self._indexes[colName] = self._buildIndex(colName, False)
+
+        return perm
 
     def print(self, formatStr=None):
-        for row in self._rows:
+        for row in self._iterRows():
             print(formatStr.format(**row._asdict()))
 
     def __len__(self):
         return self.size()
 
     def __iter__(self):
-        return iter(self._rows)
+        return self._iterRows()
 
     def __getitem__(self, item):
-        return self._rows[item]
+        """ Return a row by its index or, if item is a slice,
+        a view of the table with the rows in that range. """
+        if isinstance(item, slice):
+            return self._createView(index=np.arange(self.size())[item])
+        return self._getRow(item)
+
+    def __reduce__(self):
+        """ Compact serialization used by pickle. The table is stored
+        as the columns definition plus the values of each column. Numeric
+        columns are stored as numpy arrays, so with pickle protocol 5
+        their buffers can be transferred out-of-band.
+        """
+        return _restoreTable, (self._getSchema(), self._getColumnsData(),
+                               self._getIndexesInfo(), self.isColumnar())
+
+    def _getSchema(self):
+        return [(c.getName(), c.getType()) for c in self.getColumns()]
+
+    def _getColumnsData(self):
+        data = []
+        for col in self.getColumns():
+            colName = col.getName()
+            if self.isColumnar() or col.getType() in (int, float):
+                data.append(self.getColumnArray(colName))
+            else:
+                data.append(self.getColumnValues(colName))
+        return data
+
+    def _getIndexesInfo(self):
+        return [(c, c in self._uniqueIndexes) for c in self._indexes]
+
+    def toDict(self):
+        """ Return a dict with the columns and values of this table.
+        The result contains only basic types, so it can be serialized
+        as JSON (e.g to be sent with JsonTCPServer) and loaded with
+        Table.fromDict.
+        """
+        return {
+            'columns': [(name, _typeName(colType))
+                        for name, colType in self._getSchema()],
+            'values': [values if isinstance(values, list) else values.tolist()
+                       for values in self._getColumnsData()],
+            'indexes': self._getIndexesInfo()
+        }
+
+    @staticmethod
+    def fromDict(tableDict):
+        """ Create a new Table from a dict generated with Table.toDict. """
+        schema = [(name, _typeFromName(typeName))
+                  for name, typeName in tableDict['columns']]
+        return _restoreTable(schema, tableDict['values'],
+                             tableDict.get('indexes', []))
 
     def __setitem__(self, key, value):
+        self._ownRows()
+        if self._indexes and not isinstance(key, slice):
+            oldRow = self._rows[key]
+            self._unindexRow(oldRow)
+            try:
+                self._indexRow(value)
+            except Exception as e:
+                self._indexRow(oldRow)
+                raise e
         self._rows[key] = value
+        if self._indexes and isinstance(key, slice):
+            self._rebuildIndexes()
+        self._clearCache()
 
 
 # --------- Helper functions  ------------------------
+_rowClasses = {}  # Row classes cached by columns names
+
+
+def _getRowClass(colNames):
+    """ Return the Row class for these columns names, creating it
+    if it does not exist yet. """
+    if colNames not in _rowClasses:
+
+        class Row(namedtuple('_Row', colNames)):
+            __slots__ = ()
+
+            def hasColumn(self, colName):
+                """ Return True if the row has this column. """
+                return hasattr(self, colName)
+
+            def hasAnyColumn(self, colNames):
+                return any(self.hasColumn(c) for c in colNames)
+
+            def hasAllColumns(self, colNames):
+                return all(self.hasColumn(c) for c in colNames)
+
+            def set(self, key, value):
+                return setattr(self, key, value)
+
+            def get(self, key, default=None):
+                return getattr(self, key, default)
+
+            def __reduce__(self):
+                # Rows are pickled by its columns names and values, so
+                # the Row class can be retrieved in other processes
+                return _restoreRow, (self._fields, tuple(self))
+
+        _rowClasses.setdefault(colNames, Row)
+
+    return _rowClasses[colNames]
+
+
+def _restoreRow(colNames, values):
+    return _getRowClass(colNames)._make(values)
+
+
+def _restoreTable(schema, data, indexes, columnar=False):
+    """ Create a Table from the columns definition and the values
+    of each column (as lists or numpy arrays). """
+    table = Table([Column(name, colType) for name, colType in schema])
+    if columnar:
+        table._setData({name: values for (name, _), values in zip(schema, data)})
+    else:
+        columns = [values.tolist() if isinstance(values, np.ndarray)
+                   else values for values in data]
+        table._rows = table._rowsFromColumns(columns)
+    for colName, unique in indexes:
+        table.createIndex(colName, unique=unique)
+    return table
+
+
+def _typeName(colType):
+    """ Return the name of the column type, to be used in toDict. """
+    return {int: 'int', float: 'float'}.get(colType, 'str')
+
+
+def _typeFromName(typeName):
+    return {'int': int, 'float': float}.get(typeName, _str)
+
+
 def _str(s):
     """ Get the string value but stripping quotes if present. """
     return s[1:-1] if s.startswith('"') and s.endswith('"') else s
@@ -297,6 +1210,103 @@ def _guessType(strValue):
             return _str
 
 
+def _dtypeFromType(colType):
+    """ Return the numpy dtype to store values of the given column type. """
+    if colType is int:
+        return np.int64
+    elif colType is float:
+        return np.float64
+    # Columns created from names only have the default string type,
+    # even if they hold numbers, so let numpy guess from the values
+    return None
+
+
+def _typeFromDtype(dtype):
+    """ Return the column type for a given numpy dtype. """
+    if dtype.kind in 'iub':
+        return int
+    elif dtype.kind == 'f':
+        return float
+    return _str
+
+
+def _toArray(values, colType, dtype=None, compact=False):
+    """ Convert a list of values of a column into a numpy array.
+
+    Args:
+        values: list with the values.
+        colType: the type of the column.
+        dtype: if not None, use this numpy type for the array.
+        compact: if True, use 32 bits types for numbers if the precision
+            allows and share repeated strings.
+    """
+    if dtype is not None:
+        return np.array(values, dtype=dtype)
+
+    if colType is int or colType is float:
+        values = _columnArray(values, colType)
+    else:
+        # Columns with default string type might contain numbers
+        array = np.array(values)
+        if array.dtype.kind in 'iuf':
+            values = array
+        else:
+            if compact:
+                values = [sys.intern(v) if type(v) is str else v
+                          for v in values]
+            array = np.empty(len(values), dtype=object)
+            array[:] = values
+            return array
+
+    return _compactArray(values) if compact else values
+
+
+def _columnArray(values, colType):
+    """ Return an array with the values of a column, with the dtype of the
+    column type, unless the values do not match it (e.g. floats in an int
+    column), then the dtype is guessed from the values to not lose data.
+    """
+    dtype = _dtypeFromType(colType)
+    if dtype is None or not len(values):
+        return np.array(values, dtype=dtype)
+    array = np.array(values)
+    kinds = 'iub' if colType is int else 'iubf'
+    return array.astype(dtype, copy=False) if array.dtype.kind in kinds else array
+
+
+def _compactArray(values):
+    """ Return the array with 32 bits type if values can be represented. """
+    if values.size:
+        if values.dtype.kind == 'i':
+            info = np.iinfo(np.int32)
+            if info.min <= values.min() and values.max() <= info.max:
+                return values.astype(np.int32)
+        elif values.dtype.kind == 'f':
+            # Only if values are the same with the 6 decimals used
+            # when writing STAR files
+            values32 = values.astype(np.float32)
+            if np.array_equal(np.round(values32.astype(np.float64), 6),
+                              np.round(values, 6), equal_nan=True):
+                return values32
+    return values
+
+
+def _readOnly(values):
+    """ Return a read-only view of the array, without copying data. """
+    values = values.view()
+    values.flags.writeable = False
+    return values
+
+
+def _typeFromValue(value):
+    """ Return the column type for a given value. """
+    if isinstance(value, (bool, int, np.integer)):
+        return int
+    elif isinstance(value, (float, np.floating)):
+        return float
+    return _str
+
+
 def _formatValue(v):
     return '%0.6f' % v if isinstance(v, float) else str(v)
 
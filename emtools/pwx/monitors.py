@@ -19,6 +19,8 @@ import time
 from datetime import datetime
 from collections import OrderedDict
 
+from emtools.utils import FileWatcher
+
 
 import pyworkflow.protocol as pwprot
 
@@ -130,6 +132,11 @@ class SetMonitor(OrderedDict):
             for item in blacklist:
                 self[item.getObjId()] = True
 
+    @property
+    def fileName(self):
+        """ Path of the monitored sqlite file, as in other monitors. """
+        return self._filename
+
     def update(self):
         newItems = []
         now = datetime.now()
@@ -151,11 +158,15 @@ class SetMonitor(OrderedDict):
         return newItems
 
     def newItems(self, sleep=10):
-        """ Yield new items since last update until the stream is closed. """
-        while not self.streamClosed:
-            for ni in self.update():
-                yield ni
-            time.sleep(sleep)
+        """ Yield new items since last update until the stream is closed.
+        Between updates, it will wait until the sqlite file is modified
+        or at most 'sleep' seconds.
+        """
+        with FileWatcher(self._filename) as watcher:
+            while not self.streamClosed:
+                for ni in self.update():
+                    yield ni
+                watcher.wait(timeout=sleep)
 
     def iterProtocolInput(self, prot, label, waitSecs=60):
         """ Keep monitoring of an input set and yield new items.
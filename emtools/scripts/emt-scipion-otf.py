@@ -161,7 +161,6 @@ def run2DPipeline(wf, protExtract):
         lastParticleIndex = 0
         lastGs = None
         # Classify in batches
-        lastMt = 0
         extractSqliteFn = protExtract.outputParticles.getFileName()
         tmpSqliteFn = '/tmp/particles.sqlite'
 
@@ -172,14 +171,13 @@ def run2DPipeline(wf, protExtract):
 
             print("Wake up!!!")
             mt = os.path.getmtime(extractSqliteFn)
-            if mt > lastMt:
-                # Let's iterate over the particles to check if there is a
-                # new GridSquare and launch a subset and 2D classification job
-                # but Let's make a backup of the input particles to avoid DataBase
-                # locked error from Sqlite when much concurrency
-                print("Copying database....")
-                Process.system(f'rm -rf {tmpSqliteFn}')
-                SqliteFile.copyDb(extractSqliteFn, tmpSqliteFn, tries=10, wait=30)
+            # Let's iterate over the particles to check if there is a
+            # new GridSquare and launch a subset and 2D classification job
+            # but Let's make a backup of the input particles to avoid DataBase
+            # locked error from Sqlite when much concurrency
+            # (the copy is skipped if the input has not changed)
+            print("Copying database....")
+            if SqliteFile.copyDb(extractSqliteFn, tmpSqliteFn, tries=10, wait=5):
                 print("Copy done!")
 
             parts = SetOfParticles(filename=tmpSqliteFn)
@@ -230,8 +228,6 @@ def run2DPipeline(wf, protExtract):
                     print("Not much to do, just quitting 2D batch generation")
                     break
 
-            lastMt = mt
-
     def _run2D(batch):
         protRelion2D = batch['prot']
         wf.launchProtocol(protRelion2D, wait=True)
@@ -12,7 +12,7 @@ from emtools.utils import Color
 from emtools.metadata import StarFile, EPU, Table
 
 
-def parse(inputDir, outputStar):
+def parse(inputDir, outputStar, workers=4, cache=None):
     """ Parse all xml files from the inputDir for each movie. """
     if not os.path.exists(inputDir):
         raise Exception(f"Input dir '{Color.red(inputDir)}' does not exist.")
@@ -26,11 +26,24 @@ def parse(inputDir, outputStar):
     out.writeHeader('Movies', t)
 
     i = 0
-    for base, x, y in EPU.get_beam_shifts(inputDir):
-        i += 1
+    rows = []
+
+    def _writeRows():
+        out.writeRows(rows)
+        rows.clear()
         print("\rParsed: ", i, end="")
-        out.writeRow(t.Row(movieBaseName=base, beamShiftX=x, beamShiftY=y))
 
+    for base, values in EPU.harvest(inputDir, ['beamShiftX', 'beamShiftY'],
+                                    workers=workers, cache=cache):
+        i += 1
+        # Use the same value for missing shifts than EPU.Data
+        rows.append(t.Row(movieBaseName=base,
+                          beamShiftX=values['beamShiftX'] or '-9999.0',
+                          beamShiftY=values['beamShiftY'] or '-9999.0'))
+        if len(rows) == 1000:
+            _writeRows()
+
+    _writeRows()
     print()
 
     if outputStar:
@@ -73,21 +86,18 @@ class Cluster:
 def plot(inputStar, distance=0.005):
     """ Make a scatter plot from the star files with x, y beam shifts. """
     import matplotlib.pyplot as plt
-    xvalues = []
-    yvalues = []
     colors = []
-    points = []
     cluster = Cluster(distance)
 
     with StarFile(inputStar) as sf:
-        for i, row in enumerate(sf.iterTable('Movies')):
-            xvalues.append(row.beamShiftX)
-            yvalues.append(row.beamShiftY)
-            points.append({'x': row.beamShiftX, 'y': row.beamShiftY, 'i': i + 1})
+        movies = sf.getTable('Movies')
+
+    xvalues = movies.getColumnArray('beamShiftX')
+    yvalues = movies.getColumnArray('beamShiftY')
 
-        for p in points:
-            group = cluster.addPoint(p)
-            colors.append(group)
+    for i, (x, y) in enumerate(zip(xvalues.tolist(), yvalues.tolist())):
+        group = cluster.addPoint({'x': x, 'y': y, 'i': i + 1})
+        colors.append(group)
 
     print("Groups: ", len(cluster.groups))
 
@@ -141,11 +151,21 @@ def main():
                         help="Output file depending in the action. ")
     parser.add_argument('--distance', '-d', default=0.005, type=float,
                         help="Distance for clusters")
+    parser.add_argument('--workers', '-j', default=4, type=int,
+                        help="Number of processes to parse xml files "
+                             "with --parse")
+    parser.add_argument('--cache', metavar='CACHE_DB',
+                        help="Sqlite file to store values parsed from xml "
+                             "files with --parse, that can be shared "
+                             "between runs or tools.")
 
     args = parser.parse_args()
 
     if args.parse:
-        parse(args.parse, args.output)
+        cache = EPU.Cache(args.cache) if args.cache else None
+        parse(args.parse, args.output, args.workers, cache)
+        if cache is not None:
+            cache.close()
     elif args.plot:
         plot(args.plot, args.distance)
     elif args.make_groups:
@@ -23,15 +23,23 @@ def main():
     p.add_argument('--backup', '-b', metavar='BACKUP_FOLDER',
                    help="Backup JPG and some XML files.")
 
+    p.add_argument('--cache', metavar='CACHE_DB',
+                   help="Sqlite file to store values parsed from xml files, "
+                        "that can be shared between runs or tools.")
+
     p.add_argument('--info', action='store_true')
 
     args = p.parse_args()
 
     kwargs = {}
     if args.scan:
-        s = EPU.Session(args.scan, outputStar=args.output, backupFolder=args.backup)
+        cache = EPU.Cache(args.cache) if args.cache else None
+        s = EPU.Session(args.scan, outputStar=args.output, backupFolder=args.backup,
+                        cache=cache)
         s.scan()
         s.df.print()
+        if cache is not None:
+            cache.close()
 
 
 if __name__ == '__main__':
@@ -20,11 +20,23 @@ import random
 import time
 import threading
 import tempfile
+import pickle
+import json
+import copy
+import io
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import redirect_stdout
 from pprint import pprint
 from datetime import datetime
+from xml.parsers import expat
+
+import numpy as np
 
 from emtools.utils import Timer, Color, Pretty
-from emtools.metadata import StarFile, SqliteFile, EPU, StarMonitor
+from emtools.metadata import (StarFile, SqliteFile, EPU, StarMonitor, Table,
+                              SeenKeys, HashedSeenKeys, SeenRowCount,
+                              MonitorGroup, SqliteMonitor)
 from emtools.jobs import BatchManager
 from emtools.tests import testpath
 
@@ -42,6 +54,358 @@ except:
     emtable = None
 
 
+class TestTable(unittest.TestCase):
+    """
+    Tests for Table class.
+    """
+    def _createTable(self, n=10):
+        t = Table(['rlnMicrographName', 'rlnDefocusU', 'rlnDefocusV',
+                   'rlnCtfFigureOfMerit'])
+        for i in range(n):
+            t.addRowValues(f'mic_{i % 3:03}.mrc', 10000.0 + i * 100,
+                           10000.0 - i * 100, i)
+        return t
+
+    def test_addColumns(self):
+        t = self._createTable()
+
+        t.addColumns('rlnCtfAstigmatism=abs(rlnDefocusU - rlnDefocusV)',
+                     'rlnDefocusU=rlnDefocusU / 10000',
+                     'rlnGood=rlnCtfAstigmatism < 1000',
+                     'rlnDefocusAngle=0.0',
+                     'rlnMicrographMovieName=rlnMicrographName',
+                     'rlnOpticsGroupName=opticsGroup1')
+        self.assertEqual(t.getColumnNames(),
+                         ['rlnMicrographName', 'rlnDefocusU', 'rlnDefocusV',
+                          'rlnCtfFigureOfMerit', 'rlnCtfAstigmatism',
+                          'rlnGood', 'rlnDefocusAngle',
+                          'rlnMicrographMovieName', 'rlnOpticsGroupName'])
+        self.assertEqual(t.getColumn('rlnGood').getType(), int)
+
+        for i, row in enumerate(t):
+            self.assertAlmostEqual(row.rlnCtfAstigmatism, i * 200)
+            self.assertAlmostEqual(row.rlnDefocusU, 1 + i * 0.01)
+            self.assertEqual(row.rlnGood, int(i * 200 < 1000))
+            self.assertEqual(row.rlnDefocusAngle, 0.0)
+            self.assertEqual(row.rlnMicrographMovieName, row.rlnMicrographName)
+            self.assertEqual(row.rlnOpticsGroupName, 'opticsGroup1')
+
+        values = t.evaluate('where(rlnGood, max(rlnDefocusU, 1.05), -1)')
+        self.assertEqual(len(values), len(t))
+        self.assertAlmostEqual(values[0], 1.05)
+        self.assertEqual(values[-1], -1)
+
+        with self.assertRaises(Exception):
+            t.evaluate('rlnDefocusU.__class__')
+        with self.assertRaises(Exception):
+            t.evaluate('open(rlnMicrographName)')
+        with self.assertRaises(Exception):
+            t.evaluate('rlnDefocusU.conj(1)')
+        # Too large constant values should be rejected before evaluating
+        for text in ['9**9**9', "'x' * 10**9", "('x' * 1000) * 1000"]:
+            with self.assertRaises(Exception):
+                t.evaluate(text)
+        self.assertEqual(t.evaluate("rlnDefocusAngle + 2**10")[0], 1024)
+
+    def test_views(self):
+        t = self._createTable()
+
+        t1 = t.filter('rlnCtfFigureOfMerit >= 5')
+        self.assertTrue(t1.isView())
+        self.assertEqual(len(t1), 5)
+        self.assertEqual(t1[0], t[5])
+        self.assertEqual(t1.getColumnValues('rlnCtfFigureOfMerit'),
+                         [5, 6, 7, 8, 9])
+
+        t2 = t1.filter(lambda row: row.rlnMicrographName == 'mic_000.mrc')
+        self.assertEqual([r.rlnCtfFigureOfMerit for r in t2], [6, 9])
+
+        t3 = t2.select('rlnCtfFigureOfMerit', 'rlnMicrographName')
+        self.assertEqual(t3.getColumnNames(),
+                         ['rlnCtfFigureOfMerit', 'rlnMicrographName'])
+        self.assertEqual(tuple(t3[1]), (9, 'mic_000.mrc'))
+
+        t4 = t[2:8:2]
+        self.assertEqual(t4.getColumnValues('rlnCtfFigureOfMerit'), [2, 4, 6])
+        self.assertEqual(len(t[-3:]), 3)
+
+        # Modifying a view should not modify the original table
+        t4.addRowValues('mic_new.mrc', 0.0, 0.0, 100)
+        t4[0] = t4[0]._replace(rlnCtfFigureOfMerit=-1)
+        self.assertFalse(t4.isView())
+        self.assertEqual(t4.getColumnValues('rlnCtfFigureOfMerit'),
+                         [-1, 4, 6, 100])
+        self.assertEqual(len(t), 10)
+        self.assertEqual(t[2].rlnCtfFigureOfMerit, 2)
+
+        # Neither modifying the original table should change the views
+        t[5] = t[5]._replace(rlnCtfFigureOfMerit=-5)
+        self.assertEqual(t1[0].rlnCtfFigureOfMerit, 5)
+
+        # or appending rows to it
+        t5 = t.select('rlnCtfFigureOfMerit')
+        t6 = t.select(t.getColumnNames())
+        t.addRowValues('mic_new.mrc', 0.0, 0.0, 200)
+        t.addRow(t[0])
+        t.extend([t[1], t[2]])
+        self.assertEqual(len(t), 14)
+        self.assertEqual(len(t5), 10)
+        self.assertEqual(len(t6), 10)
+        self.assertNotIn(200, t5.getColumnValues('rlnCtfFigureOfMerit'))
+
+        # Views can be written as any other table
+        t3 = t.select(['rlnMicrographName', 'rlnCtfFigureOfMerit'])
+        with tempfile.TemporaryDirectory() as tmp:
+            fn = os.path.join(tmp, 'subset.star')
+            with StarFile(fn, 'w') as sf:
+                sf.writeTable('subset', t3)
+            with StarFile(fn) as sf:
+                self.assertEqual(list(sf.getTable('subset')), list(t3))
+
+    def test_sort(self):
+        t = self._createTable()
+        rows = list(t)
+
+        perm = t.sort(keys=[('rlnMicrographName', 'asc'),
+                            ('rlnCtfFigureOfMerit', 'desc')])
+        self.assertEqual(list(perm), [9, 6, 3, 0, 7, 4, 1, 8, 5, 2])
+        self.assertEqual(list(t), [rows[i] for i in perm])
+        self.assertEqual(list(t.getColumnArray('rlnCtfFigureOfMerit')),
+                         [rows[i].rlnCtfFigureOfMerit for i in perm])
+
+        t.sort('rlnDefocusV')
+        self.assertEqual(list(t), rows[::-1])
+
+        t.sort(lambda row: row.rlnDefocusV, reverse=True)
+        self.assertEqual(list(t), rows)
+
+        # Stable sorting by micrograph and then by foms
+        t.sort('rlnMicrographName')
+        foms = t.getColumnValues('rlnCtfFigureOfMerit')
+        self.assertEqual(foms, [0, 3, 6, 9, 1, 4, 7, 2, 5, 8])
+
+        # Order is kept after adding new rows
+        t.addRowValues('mic_000.mrc', 0.0, 0.0, 10)
+        foms.append(10)
+        self.assertFalse(t.isView())
+        self.assertEqual(t.getColumnValues('rlnCtfFigureOfMerit'), foms)
+
+    def test_indexes(self):
+        t = self._createTable()
+        t.createIndex('rlnMicrographName')
+        t.createIndex('rlnCtfFigureOfMerit', unique=True)
+
+        self.assertTrue(t.contains('rlnMicrographName', 'mic_001.mrc'))
+        self.assertFalse(t.contains('rlnMicrographName', 'mic_003.mrc'))
+        self.assertEqual(len(t.lookup('rlnMicrographName', 'mic_000.mrc')), 4)
+        self.assertEqual(t.lookup('rlnCtfFigureOfMerit', 5), t[5])
+        self.assertIsNone(t.lookup('rlnCtfFigureOfMerit', 50))
+
+        row = t.addRowValues('mic_003.mrc', 0.0, 0.0, 10)
+        self.assertEqual(t.lookup('rlnMicrographName', 'mic_003.mrc'), [row])
+        self.assertEqual(t.lookup('rlnCtfFigureOfMerit', 10), row)
+
+        with self.assertRaises(Exception):
+            t.addRowValues('mic_003.mrc', 0.0, 0.0, 10)
+        self.assertEqual(len(t), 11)
+
+        t[0] = t[0]._replace(rlnMicrographName='mic_004.mrc')
+        self.assertEqual(len(t.lookup('rlnMicrographName', 'mic_000.mrc')), 3)
+        self.assertEqual(t.lookup('rlnMicrographName', 'mic_004.mrc'), [t[0]])
+
+        t.sort('rlnCtfFigureOfMerit', reverse=True)
+        foms = [r.rlnCtfFigureOfMerit
+                for r in t.lookup('rlnMicrographName', 'mic_000.mrc')]
+        self.assertEqual(foms, [9, 6, 3])
+
+        with self.assertRaises(Exception):
+            t.createIndex('rlnMicrographName', unique=True)
+        self.assertTrue(t.contains('rlnMicrographName', 'mic_000.mrc'))
+        with self.assertRaises(Exception):
+            t.lookup('rlnDefocusU', 0.0)
+
+    def test_serialization(self):
+        t = self._createTable()
+        t.createIndex('rlnMicrographName')
+        t.addColumns('rlnDefocusAngle=0.0', 'rlnImageId=rlnCtfFigureOfMerit + 1')
+
+        # Pickle with out-of-band buffers for numeric columns
+        buffers = []
+        data = pickle.dumps(t, protocol=5, buffer_callback=buffers.append)
+        self.assertEqual(len(buffers), 2)
+        t2 = pickle.loads(data, buffers=buffers)
+        self.assertEqual(list(t2), list(t))
+        self.assertEqual(t2.getColumnNames(), t.getColumnNames())
+        self.assertEqual(t2.getColumn('rlnImageId').getType(), int)
+        self.assertEqual(len(t2.lookup('rlnMicrographName', 'mic_001.mrc')), 3)
+
+        # Rows and views can be pickled
+        row = pickle.loads(pickle.dumps(t[3]))
+        self.assertEqual(row, t[3])
+        self.assertIs(type(row), t.Row)
+        view = t.filter('rlnImageId > 8').select('rlnImageId')
+        self.assertEqual(list(pickle.loads(pickle.dumps(view))), list(view))
+
+        # Send rows to other processes
+        with ProcessPoolExecutor(max_workers=2) as executor:
+            self.assertEqual(list(executor.map(len, [t, view])), [10, 2])
+            rows = list(executor.map(copy.copy, t))
+            self.assertEqual(rows, list(t))
+
+        # Json compatible dict
+        t3 = Table.fromDict(json.loads(json.dumps(t.toDict())))
+        self.assertEqual(list(t3), list(t))
+
+        # Values not matching the column type are not truncated
+        t.addRowValues('mic_010.mrc', 1.0, 1.0, 10, 0.0, 11.5)
+        self.assertEqual(t.getColumnArray('rlnImageId')[-1], 11.5)
+        t2 = pickle.loads(pickle.dumps(t))
+        self.assertEqual(t2[-1].rlnImageId, 11.5)
+        self.assertEqual(t2[0].rlnImageId, t[0].rlnImageId)
+
+    def test_bulk(self):
+        t1 = self._createTable(5)
+        t2 = self._createTable(5)
+        t1.extend(t2)
+        t1.extend(t2.select('rlnCtfFigureOfMerit', 'rlnMicrographName',
+                            'rlnDefocusV', 'rlnDefocusU'))
+        t1.extend([('mic_010.mrc', 1.0, 1.0, 10),
+                   {'rlnMicrographName': 'mic_011.mrc', 'rlnDefocusU': 1.0,
+                    'rlnDefocusV': 1.0, 'rlnCtfFigureOfMerit': 11}])
+        self.assertEqual(len(t1), 17)
+        self.assertEqual(list(t1[5:10]), list(t2))
+        self.assertEqual(list(t1[10:15]), list(t2))
+        self.assertEqual(t1[-1].rlnCtfFigureOfMerit, 11)
+
+        t3 = Table.fromArrays({
+            'rlnMicrographName': [f'mic_{i:03}.mrc' for i in range(3)],
+            'rlnDefocusU': np.array([1.0, 2.0, 3.0]),
+            'rlnCtfFigureOfMerit': np.arange(3)
+        })
+        self.assertEqual(t3.getColumn('rlnCtfFigureOfMerit').getType(), int)
+        self.assertEqual(t3[2].rlnDefocusU, 3.0)
+
+        t4 = Table.fromRecords(row._asdict() for row in t3)
+        self.assertEqual(list(t4), list(t3))
+        t5 = Table.fromRecords(iter(t3))
+        self.assertEqual(t5.getColumnNames(), t3.getColumnNames())
+
+        t6 = Table.concat([t2, t3], fill=0.0)
+        self.assertEqual(t6.getColumnNames(), t2.getColumnNames())
+        self.assertEqual(len(t6), 8)
+        self.assertEqual(t6[-1].rlnDefocusV, 0.0)
+        with self.assertRaises(Exception):
+            Table.concat([t2, t3])
+
+        # Mixed int and str columns are promoted to str values
+        t7 = Table.fromArrays({'rlnGroupName': [1, 2]})
+        t8 = Table.fromArrays({'rlnGroupName': ['group3']})
+        t9 = Table.concat([t7, t8, Table.fromNumpy(t7.toNumpy())])
+        self.assertNotIn(t9.getColumn('rlnGroupName').getType(), [int, float])
+        self.assertEqual(t9.getColumnValues('rlnGroupName'),
+                         ['1', '2', 'group3', '1', '2'])
+        self.assertEqual(t9.getColumnArray('rlnGroupName').tolist(),
+                         ['1', '2', 'group3', '1', '2'])
+
+    def test_numpy(self):
+        t = self._createTable()
+        arrays = t.toNumpy()
+        self.assertIs(arrays['rlnDefocusU'], t.getColumnArray('rlnDefocusU'))
+        self.assertEqual(arrays['rlnCtfFigureOfMerit'].dtype.kind, 'i')
+
+        x = np.arange(10, dtype=np.float32)
+        t2 = Table.fromNumpy({'rlnCoordinateX': x, 'rlnCoordinateY': x * 2,
+                              'rlnMicrographName': arrays['rlnMicrographName']})
+        self.assertTrue(t2.isColumnar())
+        self.assertEqual(len(t2), 10)
+        self.assertEqual(t2.getColumn('rlnCoordinateX').getType(), float)
+        self.assertTrue(np.shares_memory(t2.getColumnArray('rlnCoordinateX'), x))
+        self.assertEqual(t2[-1].rlnCoordinateY, 18.0)
+        self.assertEqual([r.rlnMicrographName for r in t2],
+                         t.getColumnValues('rlnMicrographName'))
+
+        # Views, sorting and new columns without creating rows
+        t3 = t2.filter('rlnCoordinateX > 6').select('rlnCoordinateY')
+        self.assertEqual(t3.getColumnValues('rlnCoordinateY'), [14, 16, 18])
+        t2.sort('rlnCoordinateY', reverse=True)
+        t2.addColumns('rlnAutopickFigureOfMerit=rlnCoordinateX / 10')
+        self.assertTrue(t2.isColumnar())
+        self.assertAlmostEqual(t2[0].rlnAutopickFigureOfMerit, 0.9)
+
+        # Rows are created when modified
+        t2.addRowValues(-1.0, -1.0, 'mic_new.mrc', 0.0)
+        self.assertFalse(t2.isColumnar())
+        self.assertEqual(len(t2), 11)
+
+        s = t.toNumpy(['rlnMicrographName', 'rlnDefocusV'], structured=True)
+        t4 = Table.fromNumpy(s)
+        self.assertEqual(list(t4), list(t.select('rlnMicrographName',
+                                                 'rlnDefocusV')))
+
+        try:
+            import pandas
+        except ImportError:
+            return
+
+        df = t.toPandas()
+        self.assertEqual(list(df.columns), t.getColumnNames())
+        self.assertEqual(list(Table.fromPandas(df)), list(t))
+
+    def test_compact(self):
+        t = self._createTable(1000)
+        usage = t.memoryUsage()
+        self.assertEqual(list(usage['columns']), t.getColumnNames())
+        self.assertEqual(usage['total'],
+                         sum(usage['columns'].values()) + usage['rows']
+                         + usage['index'] + usage['cache'])
+
+        with tempfile.TemporaryDirectory() as tmp:
+            fn = os.path.join(tmp, 'ctfs.star')
+            with StarFile(fn, 'w') as sf:
+                sf.writeTable('micrographs', t)
+
+            with StarFile(fn) as sf:
+                t1 = sf.getTable('micrographs', compact=True)
+                t2 = sf.getTable('micrographs',
+                                 dtypes={'rlnDefocusU': 'float32'})
+
+        self.assertTrue(t1.isColumnar())
+        arrays = t1.toNumpy()
+        self.assertEqual(arrays['rlnDefocusU'].dtype, np.float32)
+        self.assertEqual(arrays['rlnCtfFigureOfMerit'].dtype, np.int32)
+        self.assertEqual(t1.getColumn('rlnCtfFigureOfMerit').getType(), int)
+        self.assertEqual(list(t1), list(t))
+        self.assertLess(t1.memoryUsage()['total'], usage['total'])
+
+        arrays = t2.toNumpy()
+        self.assertEqual(arrays['rlnDefocusU'].dtype, np.float32)
+        self.assertEqual(arrays['rlnDefocusV'].dtype, np.float64)
+
+        t.compact()
+        self.assertTrue(t.isColumnar())
+        self.assertEqual(list(t), list(t1))
+
+        # Float columns are only compacted if values are written the same
+        t = Table(['rlnCoordinateX', 'rlnDefocusU'])
+        for i in range(100):
+            t.addRowValues(i * 0.25, 12345.678901 + i)
+        lines = self._tableLines(t)
+        t.compact()
+        arrays = t.toNumpy()
+        self.assertEqual(arrays['rlnCoordinateX'].dtype, np.float32)
+        self.assertEqual(arrays['rlnDefocusU'].dtype, np.float64)
+        self.assertEqual(t[0].rlnDefocusU, 12345.678901)
+        self.assertEqual(self._tableLines(t), lines)
+
+    def _tableLines(self, t):
+        with tempfile.TemporaryDirectory() as tmp:
+            fn = os.path.join(tmp, 'table.star')
+            with StarFile(fn, 'w') as sf:
+                sf.writeTable('table', t)
+            with open(fn) as f:
+                return f.readlines()
+
+
 class TestStarFile(unittest.TestCase):
     """
     Tests for StarFile class.
@@ -313,6 +677,178 @@ class TestStarFile(unittest.TestCase):
 
         os.unlink(ftmp.name)
 
+    def test_star_monitor_tail(self):
+        """ Check that only new complete lines are parsed by the monitor
+        and that rewritten files are scanned again. """
+        for seen in [SeenKeys(), HashedSeenKeys(), SeenRowCount()]:
+            self._test_star_monitor_tail(seen)
+
+    def test_seen_keys(self):
+        """ Keys seen in previous groups are not new, no matter the
+        length of the other keys in the group. """
+        for seen in [SeenKeys(), HashedSeenKeys()]:
+            self.assertEqual(seen.filterNew(['000001@a.mrcs']), [True])
+            self.assertEqual(seen.filterNew(['000001@a.mrcs',
+                                             '000002@particles_long.mrcs',
+                                             '000002@particles_long.mrcs']),
+                             [False, True, False])
+            self.assertEqual(seen.filterNew(['a', '000001@a.mrcs', 5]),
+                             [True, False, True])
+            self.assertEqual(seen.filterNew([5, 6]), [False, True])
+            self.assertIn('000002@particles_long.mrcs', seen)
+            self.assertEqual(len(seen), 5)
+            # Integers out of the 64 bits range are also valid keys
+            self.assertEqual(seen.filterNew([2**64 + 1, -2**63 - 1, 6]),
+                             [True, True, False])
+            self.assertEqual(seen.filterNew([2**64 + 1, 'a']), [False, False])
+
+    def _test_star_monitor_tail(self, seen):
+        t = Table(['rlnImageId', 'rlnImageName'])
+        for i in range(5):
+            t.addRowValues(i, f'{i:06}@particles.mrcs')
+
+        with tempfile.TemporaryDirectory() as tmp:
+            fn = os.path.join(tmp, 'particles.star')
+            with StarFile(fn, 'w') as sf:
+                sf.writeTable('optics', Table(['rlnOpticsGroup']))
+                sf.writeHeader('particles', t)
+                for row in t:
+                    sf.writeRow(row)
+
+            monitor = StarMonitor(fn, 'particles',
+                                  lambda row: row.rlnImageName, seen=seen,
+                                  blacklist=t[:2])
+            self.assertEqual([r.rlnImageId for r in monitor.update()],
+                             [2, 3, 4])
+            self.assertEqual(monitor.update(), [])
+
+            # Append a complete row and an incomplete one
+            with open(fn, 'a') as f:
+                f.write('5 000005@particles.mrcs\n6 0000')
+            self.assertEqual([r.rlnImageId for r in monitor.update()], [5])
+            with open(fn, 'a') as f:
+                f.write('06@particles.mrcs\n')
+            rows = monitor.update()
+            self.assertEqual(rows[0].rlnImageName, '000006@particles.mrcs')
+            self.assertEqual(monitor.inputCount, 5)
+            self.assertEqual(len(seen), 7)
+
+            # Rewrite the file with new rows, seen ones are not returned
+            for i in [5, 6, 10]:
+                t.addRowValues(i, f'{i:06}@particles.mrcs')
+            with StarFile(fn, 'w') as sf:
+                sf.writeTable('particles', t)
+            self.assertEqual([r.rlnImageId for r in monitor.update()], [10])
+
+    def test_star_monitor_last_row(self):
+        """ A complete last row without newline is returned when the
+        file has not changed in the next update. """
+        with tempfile.TemporaryDirectory() as tmp:
+            fn = os.path.join(tmp, 'particles.star')
+            with open(fn, 'w') as f:
+                f.write('data_particles\n\nloop_\n_rlnImageId\n_rlnImageName\n'
+                        '1 000001@particles.mrcs\n2 000002@particles.mrcs')
+
+            monitor = StarMonitor(fn, 'particles',
+                                  lambda row: row.rlnImageName)
+            self.assertEqual([r.rlnImageId for r in monitor.update()], [1])
+            self.assertEqual([r.rlnImageId for r in monitor.update()], [2])
+            self.assertEqual(monitor.update(), [])
+
+            # The same rows as reading the whole table
+            with StarFile(fn) as sf:
+                self.assertEqual(len(sf.getTable('particles')), 2)
+
+            # Rows appended later are read as usual
+            with open(fn, 'a') as f:
+                f.write('\n3 000003@particles.mrcs\n4 0000')
+            self.assertEqual([r.rlnImageId for r in monitor.update()], [3])
+            with open(fn, 'a') as f:
+                f.write('04@particles.mrcs')
+            self.assertEqual(monitor.update(), [])
+            rows = monitor.update()
+            self.assertEqual(rows[0].rlnImageName, '000004@particles.mrcs')
+            self.assertEqual(monitor.inputCount, 4)
+
+    def test_star_monitor_checkpoint(self):
+        t = Table(['rlnImageId', 'rlnImageName'])
+        for i in range(5):
+            t.addRowValues(i, f'{i:06}@particles.mrcs')
+
+        def _ids(rows):
+            return [r.rlnImageId for r in rows]
+
+        with tempfile.TemporaryDirectory() as tmp:
+            fn = os.path.join(tmp, 'particles.star')
+            checkpoint = os.path.join(tmp, 'monitor.ckpt')
+            with StarFile(fn, 'w') as sf:
+                sf.writeTable('particles', t)
+
+            def _monitor():
+                return StarMonitor(fn, 'particles', lambda row: row.rlnImageId,
+                                   seen=HashedSeenKeys(), checkpoint=checkpoint)
+
+            self.assertEqual(_ids(_monitor().update()), list(range(5)))
+            self.assertTrue(os.path.exists(checkpoint))
+
+            # After restart, only new rows are returned
+            with open(fn, 'a') as f:
+                f.write('5 000005@particles.mrcs\n')
+            monitor = _monitor()
+            self.assertEqual(monitor.inputCount, 5)
+            self.assertEqual(monitor._offset, os.path.getsize(fn) - 24)
+            self.assertEqual(_ids(monitor.update()), [5])
+            self.assertEqual(_ids(_monitor().update()), [])
+
+            # Checkpoint of other file should not be used
+            with self.assertRaises(Exception):
+                StarMonitor(fn, 'optics', lambda row: row.rlnImageId,
+                            checkpoint=checkpoint)
+
+    def test_monitor_group(self):
+        """ Monitor several files from the same thread. """
+        t = Table(['rlnImageId', 'rlnImageName'])
+
+        def _write(fn, n):
+            with StarFile(fn, 'a') as sf:
+                for i in range(n):
+                    sf.writeRowValues([i, f'{i:06}@{fn}'])
+                    sf.flush()
+                    time.sleep(0.05)
+
+        with tempfile.TemporaryDirectory() as tmp:
+            files = {os.path.join(tmp, f'particles{i}.star'): 10 * (i + 1)
+                     for i in range(3)}
+            for fn in files:
+                with StarFile(fn, 'w') as sf:
+                    sf.writeHeader('particles', t)
+
+            monitors = {StarMonitor(fn, 'particles', lambda row: row.rlnImageId,
+                                    timeout=1): fn for fn in files}
+            threads = [threading.Thread(target=_write, args=item)
+                       for item in files.items()]
+            for th in threads:
+                th.start()
+
+            counts = {fn: 0 for fn in files}
+            with MonitorGroup(*monitors, minWait=0.1, maxWait=0.5) as group:
+                for monitor, newRows in group.events():
+                    counts[monitors[monitor]] += len(newRows)
+                self.assertEqual(len(group), 0)
+
+            for th in threads:
+                th.join()
+
+            self.assertEqual(counts, files)
+
+            # Monitors keeping the path in '_filename' (e.g. SetMonitor)
+            class _Monitor:
+                _filename = fn
+
+            with MonitorGroup(_Monitor()) as group:
+                self.assertEqual(group._entries[0]['path'],
+                                 os.path.abspath(fn))
+
     def test_star_monitor(self):
         """ Basic test checking that we are able to monitor a streaming
         generated star file. The final count of rows should be the
@@ -376,6 +912,83 @@ class TestStarFile(unittest.TestCase):
 
 class TestEPU(unittest.TestCase):
     """ Tests for EPU class. """
+    MOVIE_XML = """<?xml version="1.0" encoding="utf-8"?>
+<MicroscopeImage xmlns="http://schemas.datacontract.org/2004/07/Fei.SharedObjects" xmlns:i="http://www.w3.org/2001/XMLSchema-instance">
+<name>{name}</name>
+<CustomData xmlns:a="http://schemas.microsoft.com/2003/10/Serialization/Arrays">
+<a:KeyValueOfstringanyType><a:Key>AppliedDefocus</a:Key><a:Value i:type="b:double" xmlns:b="http://www.w3.org/2001/XMLSchema">-1.4E-06</a:Value></a:KeyValueOfstringanyType>
+<a:KeyValueOfstringanyType><a:Key>Dose</a:Key><a:Value i:type="b:double" xmlns:b="http://www.w3.org/2001/XMLSchema">50.5</a:Value></a:KeyValueOfstringanyType>
+</CustomData>
+<microscopeData>
+<acquisition><acquisitionDateTime>2022-11-04T06:13:29.7+01:00</acquisitionDateTime>
+<camera><Binning xmlns:a="http://schemas.datacontract.org/2004/07/System.Drawing"><a:x>1</a:x><a:y>1</a:y></Binning>
+<DarkGainCorrection>None</DarkGainCorrection><ExposureTime>2.5</ExposureTime>
+<ReadoutArea xmlns:a="http://schemas.datacontract.org/2004/07/System.Drawing"><a:height>4096</a:height><a:width>4096</a:width></ReadoutArea></camera>
+</acquisition>
+<gun><AccelerationVoltage>300000</AccelerationVoltage></gun>
+<instrument><InstrumentID>3788</InstrumentID><InstrumentModel>TITAN52334130</InstrumentModel></instrument>
+<optics><BeamShift xmlns:a="http://schemas.datacontract.org/2004/07/Fei.Types"><a:_x>{x}</a:_x><a:_y>{y}</a:_y></BeamShift>
+<Defocus>-1.5E-06</Defocus>
+<TemMagnification><NominalMagnification>105000</NominalMagnification></TemMagnification></optics>
+<stage><Position><A>0.01</A><B>0</B><X>1.2E-05</X><Y>-3.4E-05</Y><Z>5.6E-06</Z></Position></stage>
+</microscopeData>
+<SpatialScale><pixelSize><x><numericValue>8.3E-11</numericValue></x><y><numericValue>8.3E-11</numericValue></y></pixelSize></SpatialScale>
+</MicroscopeImage>
+"""
+
+    @classmethod
+    def _writeMovieXml(cls, xmlFn, x, y):
+        """ Write a xml file similar to the EPU ones for movies. """
+        with open(xmlFn, 'w') as f:
+            f.write(cls.MOVIE_XML.format(name=os.path.basename(xmlFn),
+                                         x=x, y=y))
+
+    def test_parse_xml(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            xmlFn = os.path.join(tmp, 'FoilHole_1_Data_2_3_20221104_061329.xml')
+            self._writeMovieXml(xmlFn, 0.0123, -0.0456)
+
+            values = EPU.parse_xml(xmlFn)
+            self.assertEqual(set(values), set(EPU.XML_FIELDS))
+            self.assertEqual(values['beamShiftX'], '0.0123')
+            self.assertEqual(values['beamShiftY'], '-0.0456')
+            self.assertEqual(values['pixelSizeX'], '8.3E-11')
+            self.assertEqual(values['defocus'], '-1.5E-06')
+            self.assertEqual(values['appliedDefocus'], '-1.4E-06')
+            self.assertEqual(values['dose'], '50.5')
+            self.assertEqual(values['stageZ'], '5.6E-06')
+            self.assertEqual(values['acquisitionDateTime'],
+                             '2022-11-04T06:13:29.7+01:00')
+
+            acq = EPU.get_acquisition(xmlFn)
+            self.assertEqual(acq, {
+                'pixelSize': {'x': '0.83000', 'y': '0.83000'},
+                'voltage': '300000',
+                'instrument': {'id': '3788', 'model': 'TITAN52334130'},
+                'magnification': '105000',
+                'camera': {'Binning': {'x': '1', 'y': '1'},
+                           'DarkGainCorrection': 'None',
+                           'ExposureTime': '2.5',
+                           'ReadoutArea': {'height': '4096',
+                                           'width': '4096'}}})
+            self.assertEqual(EPU.parse_beam_shifts(xmlFn),
+                             ('0.0123', '-0.0456'))
+
+            values = EPU.parse_xml(xmlFn, {'voltage': ('microscopeData', 'gun',
+                                                       'AccelerationVoltage'),
+                                           'missing': ('microscopeData', 'X')})
+            self.assertEqual(values, {'voltage': '300000', 'missing': None})
+
+            # Parsing stops after the fields are found, the rest of
+            # the file is not read
+            with open(xmlFn) as f:
+                content = f.read()
+            with open(xmlFn, 'w') as f:
+                f.write(content[:content.index('</optics>')] + '<broken')
+            self.assertEqual(EPU.parse_beam_shifts(xmlFn),
+                             ('0.0123', '-0.0456'))
+            with self.assertRaises(expat.ExpatError):
+                EPU.parse_xml(xmlFn, ['pixelSizeX'])
 
     def test_read_acquisition(self):
         fn = 'FoilHole_5850127_Data_5798426_5798428_20221104_061329.xml'
@@ -388,6 +1001,164 @@ class TestEPU(unittest.TestCase):
                                                'magnification', 'pixelSize', 'voltage']))
         self.assertEqual(acq['instrument']['id'], '3788')
 
+    def test_harvest(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            expected = []
+            for gs in range(3):
+                dataDir = os.path.join(tmp, 'Images-Disc1',
+                                       f'GridSquare_{gs}', 'Data')
+                os.makedirs(dataDir)
+                for i in range(20):
+                    base = f'FoilHole_{gs}{i:02}_Data_1_2_20221104_0613{i:02}'
+                    movieFn = base + '_fractions.tiff'
+                    open(os.path.join(dataDir, movieFn), 'w').close()
+                    if i % 7:  # Some movies without xml
+                        x, y = round(gs * 0.1, 3), round(i * 0.001, 3)
+                        self._writeMovieXml(os.path.join(dataDir, base + '.xml'),
+                                            x, y)
+                        expected.append((movieFn, str(x), str(y)))
+
+            def _harvest(**kwargs):
+                return [(fn, v['beamShiftX'], v['beamShiftY'])
+                        for fn, v in EPU.harvest(tmp, **kwargs)]
+
+            results = _harvest(workers=3, chunkSize=4)
+            self.assertEqual(sorted(results), sorted(expected))
+            # Same order with one or many processes
+            self.assertEqual(results, _harvest(workers=1))
+            self.assertEqual(results, list(EPU.get_beam_shifts(tmp)))
+
+            # Write all rows at once and read them back
+            starFn = os.path.join(tmp, 'beamshifts.star')
+            t = Table(['movieBaseName', 'beamShiftX', 'beamShiftY'])
+            with StarFile(starFn, 'w') as sf:
+                sf.writeHeader('Movies', t)
+                sf.writeRows(results[:10])
+                sf.writeRows(t.Row(*r) for r in results[10:])
+            with StarFile(starFn) as sf:
+                t = sf.getTable('Movies', guessType=False)
+            self.assertEqual([tuple(r) for r in t], results)
+
+    def test_xml_cache(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            dataDir = os.path.join(tmp, 'Data')
+            os.makedirs(dataDir)
+            xmlFiles = []
+            for i in range(30):
+                base = os.path.join(dataDir, f'FoilHole_{i}_Data_1_2_20221104')
+                open(base + '_EER.eer', 'w').close()
+                xmlFiles.append(base + '.xml')
+                self._writeMovieXml(xmlFiles[-1], i, -i)
+
+            def _breakXml(xmlFn):
+                """ Write invalid content but keep size and mtime. """
+                s = os.stat(xmlFn)
+                with open(xmlFn, 'w') as f:
+                    f.write('x' * s.st_size)
+                os.utime(xmlFn, ns=(s.st_atime_ns, s.st_mtime_ns))
+
+            dbFile = os.path.join(tmp, 'cache.sqlite')
+            expected = list(EPU.get_beam_shifts(dataDir))
+
+            with EPU.Cache(dbFile) as cache:
+                self.assertEqual(list(EPU.harvest(dataDir, workers=2,
+                                                  chunkSize=7, cache=cache)),
+                                 list(EPU.harvest(dataDir, workers=1)))
+                self.assertEqual(len(cache), 30)
+                acq = EPU.get_acquisition(xmlFiles[0], cache=cache)
+                self.assertEqual(len(cache), 31)
+
+            # Values are read from the cache, without parsing the files
+            for xmlFn in xmlFiles[:10]:
+                _breakXml(xmlFn)
+            with EPU.Cache(dbFile) as cache:
+                self.assertEqual(list(EPU.get_beam_shifts(dataDir,
+                                                          cache=cache)),
+                                 expected)
+                self.assertEqual(EPU.get_acquisition(xmlFiles[0],
+                                                     cache=cache), acq)
+                stats, values = cache.lookup(xmlFiles[:2] + ['missing.xml'])
+                self.assertEqual(values[0]['beamShiftX'], '0')
+                self.assertEqual(values[1]['dose'], '50.5')
+                self.assertIsNone(stats[2])
+                self.assertIsNone(values[2])
+
+                # Modified files are parsed again
+                self._writeMovieXml(xmlFiles[0], 100, 200)
+                os.utime(xmlFiles[0], (time.time() + 10, time.time() + 10))
+                shifts = {fn: (x, y) for fn, x, y in
+                          EPU.get_beam_shifts(dataDir, cache=cache)}
+                self.assertEqual(shifts['FoilHole_0_Data_1_2_20221104_EER.eer'],
+                                 ('100', '200'))
+                # Fields not stored in the cache are always parsed
+                with self.assertRaises(expat.ExpatError):
+                    list(EPU.harvest(dataDir, {'x': ('optics', 'BeamShift')},
+                                     workers=1, cache=cache))
+
+    def test_session_scan(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            inputDir = os.path.join(tmp, 'session')
+            outputStar = os.path.join(tmp, 'epu.star')
+            old = time.time() - 120  # Files are registered after 1 min
+
+            def _addMovies(gs, first, n):
+                dataDir = os.path.join(inputDir, 'Images-Disc1',
+                                       f'GridSquare_{gs}', 'Data')
+                os.makedirs(dataDir, exist_ok=True)
+                for i in range(first, first + n):
+                    base = f'FoilHole_{gs}{i:03}_Data_1_2_20221104_0613'
+                    movieFn = os.path.join(dataDir, base + '_fractions.tiff')
+                    xmlFn = os.path.join(dataDir, base + '.xml')
+                    open(movieFn, 'w').close()
+                    self._writeMovieXml(xmlFn, gs, i)
+                    for fn in [movieFn, xmlFn]:
+                        os.utime(fn, (old + i, old + i))
+
+            def _scan(session):
+                with redirect_stdout(io.StringIO()) as out:
+                    session.scan()
+                with StarFile(outputStar) as sf:
+                    return (out.getvalue(), len(sf.getTable('GridSquares')),
+                            len(sf.getTable('Movies')))
+
+            _addMovies(1, 0, 10)
+            _addMovies(2, 0, 5)
+            session = EPU.Session(inputDir, outputStar=outputStar)
+            out, nGs, nMovies = _scan(session)
+            self.assertIn('Writing star', out)
+            self.assertEqual((nGs, nMovies), (2, 15))
+            # Folders modified recently are listed again in the next scan
+            self.assertEqual(session._folders, {})
+
+            # New movies in the same grid squares are appended
+            _addMovies(2, 5, 5)
+            out, nGs, nMovies = _scan(session)
+            self.assertIn('Appending to star', out)
+            self.assertEqual((nGs, nMovies), (2, 20))
+
+            # New grid squares need to write the whole file
+            _addMovies(3, 0, 3)
+            out, nGs, nMovies = _scan(session)
+            self.assertIn('Writing star', out)
+            self.assertEqual((nGs, nMovies), (3, 23))
+
+            # Old folders are not listed again if not modified
+            for root, dirs, files in os.walk(inputDir):
+                os.utime(root, (old, old))
+            session.scan()
+            self.assertEqual(len(session._folders), 8)
+            _addMovies(1, 10, 2)
+            out, nGs, nMovies = _scan(session)
+            self.assertIn('Appending to star', out)
+            self.assertEqual((nGs, nMovies), (3, 25))
+            self.assertEqual(len(session.all_movies), 25)
+
+            with StarFile(outputStar) as sf:
+                movies = sf.getTable('Movies')
+            self.assertEqual(sorted(movies.getColumnValues('beamShiftX')),
+                             sorted([1.0] * 12 + [2.0] * 10 + [3.0] * 3))
+            self.assertEqual(movies[-1].beamShiftY, 11)
+
     def test_read_session_info(self):
         sessionPath = os.environ.get('EPU_TEST_SESSION', '')
         if not sessionPath or not os.path.exists(sessionPath):
@@ -406,6 +1177,47 @@ class TestSqliteFile(unittest.TestCase):
     """
     BASIC_TABLES = ['Properties', 'Classes', 'sqlite_sequence', 'Objects']
 
+    def _createSetDb(self, dbFile, n=1000, streamState=2):
+        """ Create a sqlite file similar to the ones of Scipion sets,
+        with n particles. """
+        con = sqlite3.connect(dbFile)
+        con.executescript("""
+            CREATE TABLE Properties(key TEXT UNIQUE, value TEXT DEFAULT NULL);
+            CREATE TABLE Classes(id INTEGER PRIMARY KEY AUTOINCREMENT,
+                                 label_property TEXT UNIQUE,
+                                 column_name TEXT UNIQUE,
+                                 class_name TEXT DEFAULT NULL);
+            CREATE TABLE Objects(id INTEGER PRIMARY KEY,
+                                 enabled INTEGER DEFAULT 1,
+                                 label TEXT DEFAULT NULL,
+                                 comment TEXT DEFAULT NULL,
+                                 creation DATE,
+                                 c01 REAL DEFAULT NULL,
+                                 c02 REAL DEFAULT NULL,
+                                 c03 TEXT DEFAULT NULL,
+                                 c04 INTEGER DEFAULT NULL);
+        """)
+        con.executemany("INSERT INTO Properties VALUES (?, ?)",
+                        [('self', 'SetOfParticles'),
+                         ('_streamState', str(streamState)),
+                         ('_size', str(n))])
+        con.executemany("INSERT INTO Classes(label_property, column_name, "
+                        "class_name) VALUES (?, ?, ?)",
+                        [('self', 'self', 'Particle'),
+                         ('_coordinate._x', 'c01', 'Float'),
+                         ('_coordinate._y', 'c02', 'Float'),
+                         ('_filename', 'c03', 'String'),
+                         ('_micId', 'c04', 'Integer')])
+        self._addSetItems(con, 1, n)
+        con.commit()
+        con.close()
+
+    def _addSetItems(self, con, first, n):
+        con.executemany("INSERT INTO Objects(id, creation, c01, c02, c03, c04)"
+                        " VALUES (?, datetime('now'), ?, ?, ?, ?)",
+                        [(i, i * 0.5, i * 1.5, f'{i:06}@particles.mrcs',
+                          i // 100) for i in range(first, first + n)])
+
     def _checkColumns(self, table, columnNames):
         for colName, col in zip(columnNames, table.getColumns()):
             self.assertEqual(colName, col.getName())
@@ -432,6 +1244,274 @@ class TestSqliteFile(unittest.TestCase):
             self.assertEqual(len(props3), len(props) - 9)
             self.assertEqual(props[9], props3[0])
 
+    def test_getColumnArrays(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            dbFile = os.path.join(tmp, 'particles.sqlite')
+            self._createSetDb(dbFile)
+
+            with SqliteFile(dbFile) as sf:
+                arrays = sf.getColumnArrays('Objects', ['id', 'c01', 'c03'])
+                self.assertEqual(arrays['id'].dtype, np.int64)
+                self.assertEqual(arrays['c01'].dtype, np.float64)
+                self.assertEqual(arrays['c03'][-1], '001000@particles.mrcs')
+                self.assertTrue(np.allclose(arrays['c01'], arrays['id'] * 0.5))
+
+                arrays = sf.getColumnArrays('Objects',
+                                            ['_coordinate._y', '_micId'],
+                                            where='c04 = 3', classes='Classes')
+                self.assertEqual(list(arrays), ['_coordinate._y', '_micId'])
+                self.assertEqual(len(arrays['_micId']), 100)
+                self.assertTrue(np.all(arrays['_micId'] == 3))
+
+    def test_iterTableChunks(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            dbFile = os.path.join(tmp, 'particles.sqlite')
+            self._createSetDb(dbFile)
+
+            with SqliteFile(dbFile) as sf:
+                rows = list(sf.iterTable('Objects'))
+                chunks = list(sf.iterTableChunks('Objects', 300))
+                self.assertEqual([len(c) for c in chunks], [300, 300, 300, 100])
+                self.assertEqual([r for c in chunks for r in c], rows)
+
+                # Split in id ranges
+                ids = [r['id'] for c in sf.iterTableChunks('Objects', 64,
+                                                           afterId=200,
+                                                           untilId=500)
+                       for r in c]
+                self.assertEqual(ids, list(range(201, 501)))
+
+                row = sf.getTableRowById('Objects', 10, classes='Classes')
+                self.assertEqual(row['_filename'], '000010@particles.mrcs')
+                self.assertIsNone(sf.getTableRowById('Objects', 1001))
+
+    def test_sqliteMonitor(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            dbFile = os.path.join(tmp, 'particles.sqlite')
+            self._createSetDb(dbFile, n=100, streamState=1)
+
+            monitor = SqliteMonitor(dbFile, classes='Classes')
+            rows = monitor.update()
+            self.assertEqual(len(rows), 100)
+            self.assertEqual(rows[0]['_micId'], 0)
+            self.assertEqual(monitor.update(), [])
+            self.assertFalse(monitor.streamClosed)
+
+            # Add new items and keep the db locked for a while
+            con = sqlite3.connect(dbFile, check_same_thread=False)
+            self._addSetItems(con, 101, 50)
+            con.execute("UPDATE Properties SET value = '2' "
+                        "WHERE key = '_streamState'")
+            con.commit()
+            con.execute("BEGIN EXCLUSIVE")
+            th = threading.Timer(0.5, con.commit)
+            th.start()
+            rows = monitor.update()
+            th.join()
+            con.close()
+
+            self.assertEqual([r['id'] for r in rows], list(range(101, 151)))
+            self.assertEqual(monitor.inputCount, 150)
+            self.assertTrue(monitor.streamClosed)
+            self.assertEqual(len(list(monitor.newItems())), 0)
+
+    def test_pool(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            dbFile = os.path.join(tmp, 'particles.sqlite')
+            self._createSetDb(dbFile)
+
+            with SqliteFile(dbFile, pooled=True) as sf:
+                con = sf._con
+                self.assertEqual(sf.getTableSize('Objects'), 1000)
+            with SqliteFile(dbFile, pooled=True) as sf:
+                self.assertIs(sf._con, con)
+
+            # Connections are used by one thread at a time
+            def _count():
+                with SqliteFile(dbFile, pooled=True, immutable=True) as sf:
+                    return sum(1 for _ in sf.iterTable('Objects'))
+
+            with ThreadPoolExecutor(4) as executor:
+                counts = list(executor.map(lambda _: _count(), range(8)))
+            self.assertEqual(counts, [1000] * 8)
+
+            # Not used after the file is modified
+            time.sleep(0.01)
+            con2 = sqlite3.connect(dbFile)
+            self._addSetItems(con2, 1001, 10)
+            con2.commit()
+            con2.close()
+            with SqliteFile(dbFile, pooled=True, immutable=True) as sf:
+                self.assertIsNot(sf._con, con)
+                self.assertEqual(sf.getTableSize('Objects'), 1010)
+            SqliteFile.pool.clear()
+
+    def test_copyDb(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            dbFile = os.path.join(tmp, 'particles.sqlite')
+            copyFile = os.path.join(tmp, 'particles_copy.sqlite')
+            self._createSetDb(dbFile)
+
+            steps = []
+
+            def _progress(status, remaining, total):
+                steps.append(remaining)
+
+            self.assertTrue(SqliteFile.copyDb(dbFile, copyFile, pages=2,
+                                              progress=_progress))
+            self.assertGreater(len(steps), 1)
+            self.assertEqual(steps[-1], 0)
+            # Not copied again if not modified
+            self.assertFalse(SqliteFile.copyDb(dbFile, copyFile))
+
+            time.sleep(0.01)
+            con = sqlite3.connect(dbFile)
+            self._addSetItems(con, 1001, 10)
+            con.commit()
+            con.close()
+            self.assertTrue(SqliteFile.copyDb(dbFile, copyFile))
+            with SqliteFile(copyFile) as sf:
+                self.assertEqual(sf.getTableSize('Objects'), 1010)
+
+    def test_iterTableQuery(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            dbFile = os.path.join(tmp, 'particles.sqlite')
+            self._createSetDb(dbFile)
+
+            with SqliteFile(dbFile) as sf:
+                rows = list(sf.iterTable('Objects', columns=['id', 'c04'],
+                                         where='c04 = ? AND id > ?',
+                                         params=(3, 350), orderBy='id DESC',
+                                         chunkSize=7))
+                self.assertEqual(rows[0], {'id': 399, 'c04': 3})
+                self.assertEqual(len(rows), 49)
+
+                # Labels from classes table
+                rows = list(sf.iterTable('Objects', classes='Classes',
+                                         columns=['_filename', '_micId'],
+                                         where="_coordinate._x < ?",
+                                         params=[10], orderBy=['_micId',
+                                                               'id desc'],
+                                         start=2, limit=3))
+                self.assertEqual([r['_filename'][:6] for r in rows],
+                                 ['000017', '000016', '000015'])
+
+                for kwargs in [{'columns': ['id; DROP TABLE Objects']},
+                               {'orderBy': 'id DESCENDING'}]:
+                    with self.assertRaises(Exception):
+                        list(sf.iterTable('Objects', **kwargs))
+                with self.assertRaises(Exception):
+                    sf.getTableSize('Objects WHERE 1')
+
+    def test_concurrentIterators(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            dbFile = os.path.join(tmp, 'particles.sqlite')
+            self._createSetDb(dbFile)
+
+            with SqliteFile(dbFile) as sf:
+                # Iterate with and without labels at the same time
+                it1 = sf.iterTable('Objects', classes='Classes', chunkSize=10)
+                it2 = sf.iterTable('Objects', chunkSize=10)
+                for row1, row2 in zip(it1, it2):
+                    self.assertEqual(row1['_micId'], row2['c04'])
+                    self.assertNotIn('c04', row1)
+
+                tables = {'Objects': {'classes': 'Classes',
+                                      'columns': ['_micId']},
+                          'Properties': {},
+                          'Classes': {}}
+                results = list(sf.iterTables(tables, workers=3))
+                self.assertEqual([r[0] for r in results], list(tables))
+                self.assertEqual(len(results[0][1]), 1000)
+                self.assertEqual(results[0][1][-1], {'_micId': 10})
+                self.assertEqual(len(results[1][1]), 3)
+
+    def test_collection(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            dbFiles = []
+            for i in range(12):
+                dbFiles.append(os.path.join(tmp, f'particles{i:02}.sqlite'))
+                self._createSetDb(dbFiles[-1], n=10 * (i + 1))
+
+            for batchSize in [4, 20]:
+                with SqliteFile.union(dbFiles, batchSize=batchSize,
+                                      sourceColumn='_source') as sc:
+                    self.assertEqual(sc.getTableSize('Objects'), 780)
+                    arrays = sc.getColumnArrays('Objects',
+                                                ['_source', '_micId'],
+                                                where='id > ?', params=[100],
+                                                classes='Classes')
+                    # Ids restart in each file, only the last two have > 100
+                    self.assertEqual(len(arrays['_micId']), 10 + 20)
+                    self.assertEqual(arrays['_source'][0], 10)
+                    rows = list(sc.iterTable('Objects', where='_source = 11',
+                                             orderBy='id DESC'))
+                    self.assertEqual(rows[0]['id'], 120)
+                    self.assertEqual(len(list(sc.iterTable('Classes'))), 5)
+
+    def test_collection_merge(self):
+        """ Files are read in many batches (attach limit is 10), results
+        should be the same as reading all of them at once. """
+        with tempfile.TemporaryDirectory() as tmp:
+            dbFiles = []
+            allRows = []
+            for i in range(12):
+                dbFiles.append(os.path.join(tmp, f'particles{i:02}.sqlite'))
+                self._createSetDb(dbFiles[-1], n=3)
+                con = sqlite3.connect(dbFiles[-1])
+                for rowId in range(1, 4):
+                    con.execute("UPDATE Objects SET c01 = ? WHERE id = ?",
+                                (random.random(), rowId))
+                con.commit()
+                con.close()
+                with SqliteFile(dbFiles[-1]) as sf:
+                    for row in sf.iterTable('Objects', classes='Classes'):
+                        row['_source'] = i
+                        allRows.append(row)
+
+            def _sorted(reverse=False):
+                return sorted(allRows, key=lambda r: r['_coordinate._x'],
+                              reverse=reverse)
+
+            with SqliteFile.union(dbFiles, sourceColumn='_source') as sc:
+                def _iter(**kwargs):
+                    return list(sc.iterTable('Objects', classes='Classes',
+                                             **kwargs))
+
+                self.assertEqual(_iter(), allRows)
+                self.assertEqual(_iter(limit=5), allRows[:5])
+                self.assertEqual(_iter(start=29, limit=3), allRows[29:32])
+                self.assertEqual(_iter(orderBy='c01 DESC', limit=2),
+                                 _sorted(reverse=True)[:2])
+                self.assertEqual(_iter(orderBy='_coordinate._x', start=10),
+                                 _sorted()[10:])
+                rows = _iter(columns=['_source', 'id'],
+                             orderBy=['_coordinate._x ASC', 'id'], limit=4)
+                self.assertEqual(rows, [{'_source': r['_source'],
+                                         'id': r['id']}
+                                        for r in _sorted()[:4]])
+                self.assertEqual(len(_iter(where='id = 1')), 12)
+
+                self.assertEqual(sc.getTableRow('Objects', 31,
+                                                classes='Classes'),
+                                 allRows[31])
+                arrays = sc.getColumnArrays('Objects', ['_source', 'id'],
+                                            orderBy='c01 DESC', limit=3,
+                                            classes='Classes')
+                self.assertEqual(arrays['_source'].tolist(),
+                                 [r['_source'] for r in
+                                  _sorted(reverse=True)[:3]])
+                self.assertEqual(len(sc.getColumnArrays('Objects', ['id'])
+                                     ['id']), 36)
+
+                tables = dict(sc.iterTables(['Objects', 'Classes'],
+                                            classes='Classes'))
+                self.assertEqual(tables['Objects'], allRows)
+                self.assertEqual(len(tables['Classes']), 5)
+
+                with self.assertRaises(NotImplementedError):
+                    sc.getTableRowById('Objects', 1)
+
     def test_getTableRow(self):
         movieSqlite = testpath('metadata', 'scipion', 'movies.sqlite')
         if movieSqlite is None:
@@ -22,11 +22,14 @@
 # *
 # **************************************************************************
 
+import os
 import unittest
+import tempfile
+import threading
 import time
 from pprint import pprint
 
-from emtools.utils import Timer, System
+from emtools.utils import Timer, System, FileWatcher
 
 
 class TestTimer(unittest.TestCase):
@@ -54,3 +57,33 @@ class TestSystem(unittest.TestCase):
         h = System.hostname()
         print(">>> Hostname: ", h)
         self.assertTrue(bool(h))
+
+
+class TestFileWatcher(unittest.TestCase):
+    def test_wait(self):
+        def _append(fn, delay):
+            time.sleep(delay)
+            with open(fn, 'a') as f:
+                f.write('new line\n')
+
+        with tempfile.TemporaryDirectory() as tmp:
+            fn = os.path.join(tmp, 'particles.star')
+            # Test with inotify (if available) and polling
+            for inotify in [True, False]:
+                with FileWatcher(fn, inotify=inotify, poll=0.1) as watcher:
+                    print(">>> Using inotify: ", watcher.usingInotify())
+                    self.assertEqual(watcher.wait(timeout=0.2), set())
+
+                    th = threading.Thread(target=_append, args=(fn, 0.2))
+                    th.start()
+                    t = time.time()
+                    self.assertEqual(watcher.wait(timeout=5), {fn})
+                    self.assertLess(time.time() - t, 2)
+                    th.join()
+
+            with FileWatcher(tmp, recursive=True) as watcher:
+                os.mkdir(os.path.join(tmp, 'GridSquare_1'))
+                self.assertEqual(watcher.wait(timeout=1), {tmp})
+                if watcher.usingInotify():
+                    _append(os.path.join(tmp, 'GridSquare_1', 'a.xml'), 0)
+                    self.assertEqual(watcher.wait(timeout=1), {tmp})
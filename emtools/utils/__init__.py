@@ -21,10 +21,11 @@ from .time import Timer
 from .process import Process
 from .path import Path
 from .system import System
+from .watcher import FileWatcher
 
 from .server import JsonTCPServer, JsonTCPClient
 
 
 __all__ = ["Color", "Pretty", "Timer", "Process", "Path", "System",
-           "JsonTCPServer", "JsonTCPClient"]
+           "FileWatcher", "JsonTCPServer", "JsonTCPClient"]
 
@@ -0,0 +1,268 @@
+# **************************************************************************
+# *
+# * Authors:     J.M. de la Rosa Trevin (delarosatrevin@gmail.com)
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 3 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# **************************************************************************
+
+import os
+import sys
+import time
+import errno
+import select
+import struct
+import ctypes
+import ctypes.util
+
+# Constants from <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+
+_IN_MASK = (IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO
+            | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF)
+
+_EVENT_HEADER = struct.Struct('iIII')
+
+
+def _loadLibc():
+    """ Return libc with inotify functions or None if not available. """
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6',
+                           use_errno=True)
+        libc.inotify_init1.argtypes = [ctypes.c_int]
+        libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p,
+                                           ctypes.c_uint32]
+        return libc
+    except (OSError, AttributeError):
+        return None
+
+
+class FileWatcher:
+    """
+    Wait for changes in files or folders.
+
+    In Linux, inotify is used (through ctypes) to get notified by the
+    kernel when the watched paths are modified, so no polling is needed.
+    In other platforms or if inotify is not available, the modification
+    time and size of paths are checked every 'poll' seconds.
+
+    Files are watched through their parent folder, so changes are also
+    notified if the files are created later or replaced by renaming.
+
+    Example:
+        with FileWatcher('particles.star') as watcher:
+            while True:
+                watcher.wait(timeout=60)
+                ...read new rows...
+    """
+    def __init__(self, *paths, **kwargs):
+        """
+        Args:
+            paths: files or folders to watch.
+            kwargs:
+                recursive=False, if True, also watch subfolders
+                    of the given folders.
+                debounce=0.2, after a change is detected, wait this
+                    seconds and notify all changes together.
+                poll=1, seconds between checks when polling.
+                inotify=True, if False, always use polling.
+        """
+        self.recursive = kwargs.get('recursive', False)
+        self.debounce = kwargs.get('debounce', 0.2)
+        self.poll = kwargs.get('poll', 1)
+
+        self._libc = _loadLibc() if kwargs.get('inotify', True) else None
+        self._fd = None
+        if self._libc is not None:
+            fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+            if fd >= 0:
+                self._fd = fd
+
+        # Info for each inotify watch descriptor: the watched folder, the
+        # path to notify if any change in the folder (for folders) and
+        # the names of watched files inside it
+        self._watches = {}
+        self._polled = {}  # {path: last stat} for polled paths
+
+        for path in paths:
+            self.add(path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __del__(self):
+        self.close()
+
+    def usingInotify(self):
+        """ Return True if changes are notified by inotify. """
+        return self._fd is not None
+
+    def add(self, path):
+        """ Add a new file or folder to watch. """
+        path = os.path.abspath(path)
+        if os.path.isdir(path):
+            if not self._addWatch(path, root=path):
+                self._polled[path] = self._stat(path)
+            elif self.recursive:
+                for root, dirs, _ in os.walk(path):
+                    for d in dirs:
+                        self._addWatch(os.path.join(root, d), root=path)
+        else:
+            folder, name = os.path.split(path)
+            if not self._addWatch(folder, name=name, path=path):
+                self._polled[path] = self._stat(path)
+
+    def _addWatch(self, folder, root=None, name=None, path=None):
+        if self._fd is None:
+            return False
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(folder),
+                                          _IN_MASK)
+        if wd < 0:
+            return False
+        watch = self._watches.setdefault(wd, {'folder': folder, 'root': None,
+                                              'files': {}})
+        if root:
+            watch['root'] = root
+        if name:
+            watch['files'][name] = path
+        return True
+
+    def wait(self, timeout=None):
+        """ Block until some of the watched paths change.
+
+        Args:
+            timeout: maximum time (in seconds) to wait, if None
+                wait until there are changes.
+
+        Return:
+            The set of watched paths that changed, empty if timeout.
+        """
+        start = time.time()
+        changed = set()
+
+        while not changed:
+            remaining = None
+            if timeout is not None:
+                remaining = timeout - (time.time() - start)
+                if remaining <= 0:
+                    break
+            if self._polled or self._fd is None:
+                remaining = self.poll if remaining is None else min(remaining,
+                                                                    self.poll)
+            changed = self._readEvents(remaining) | self._checkPolled()
+
+        # Coalesce all changes that happen in the debounce window
+        if changed and self.debounce:
+            end = time.time() + self.debounce
+            remaining = self.debounce
+            while remaining > 0:
+                changed |= self._readEvents(remaining)
+                remaining = end - time.time()
+            changed |= self._checkPolled()
+
+        return changed
+
+    def _readEvents(self, timeout):
+        """ Read inotify events and return the paths that changed. """
+        if self._fd is None:
+            if timeout:
+                time.sleep(timeout)
+            return set()
+
+        ready, _, _ = select.select([self._fd], [], [], timeout)
+        if not ready:
+            return set()
+
+        changed = set()
+        data = b''
+        while True:
+            try:
+                buffer = os.read(self._fd, 65536)
+            except OSError as e:
+                if e.errno == errno.EAGAIN:
+                    break
+                raise
+            if not buffer:
+                break
+            data += buffer
+
+        i = 0
+        while i < len(data):
+            wd, mask, _, size = _EVENT_HEADER.unpack_from(data, i)
+            i += _EVENT_HEADER.size
+            name = os.fsdecode(data[i:i + size].rstrip(b'\0'))
+            i += size
+            self._processEvent(wd, mask, name, changed)
+
+        return changed
+
+    def _processEvent(self, wd, mask, name, changed):
+        if mask & IN_Q_OVERFLOW:  # Events lost, notify all paths
+            for watch in self._watches.values():
+                if watch['root']:
+                    changed.add(watch['root'])
+                changed.update(watch['files'].values())
+            return
+
+        watch = self._watches.get(wd)
+        if watch is None:
+            return
+
+        if mask & IN_IGNORED:  # Folder was removed
+            del self._watches[wd]
+        if name in watch['files']:
+            changed.add(watch['files'][name])
+        if watch['root']:
+            changed.add(watch['root'])
+            if (self.recursive and mask & IN_ISDIR
+                    and mask & (IN_CREATE | IN_MOVED_TO)):
+                self._addWatch(os.path.join(watch['folder'], name),
+                               root=watch['root'])
+
+    def _stat(self, path):
+        """ Return a value that changes when the path is modified. """
+        try:
+            s = os.stat(path)
+        except OSError:
+            return None
+        if self.recursive and os.path.isdir(path):
+            return tuple(os.stat(root).st_mtime_ns
+                         for root, _, _ in os.walk(path))
+        return s.st_mtime_ns, s.st_size
+
+    def _checkPolled(self):
+        changed = set()
+        for path, lastStat in self._polled.items():
+            s = self._stat(path)
+            if s != lastStat:
+                self._polled[path] = s
+                changed.add(path)
+        return changed
+
+    def close(self):
+        if getattr(self, '_fd', None) is not None:
+            os.close(self._fd)
+            self._fd = None